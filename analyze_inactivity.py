@@ -1,43 +1,74 @@
 from numpy import timedelta64
 from pandas import concat, read_csv
 
-from common import cleanup, initialize, logger, paths, postprocessed, refresh
+from common import cleanup, initialize, logger, paths, postprocessed, refresh, timestamps
 
 initialize()
 log = logger(__file__)
+ROWS = 1_000_000
 
 
-def import_dataset(project):
+def import_dataset_pulls(project):
     return read_csv(
-        paths("dataset", project),
-        usecols=["event", "opened_at", "merged_at", "merged", "core"],
-        dtype={"event": "category"},
-        parse_dates=["opened_at", "merged_at"],
-        infer_datetime_format=True,
+        paths("dataset_pulls", project),
+        usecols=["opened_at", "merged_at", "merged"],
+        chunksize=ROWS,
     )
 
 
-def export_inactivity(inactivity):
-    inactivity.to_csv(paths("inactivity"), index=False)
+def import_lifetimes(project):
+    return read_csv(paths("lifetimes", project))
+
+
+def count_lifetimes(project):
+    log.info(f"{project}: Counting lifetimes")
+    partials = []
+    for chunk in import_dataset_pulls(project):
+        data = timestamps(chunk.query("merged")[["opened_at", "merged_at"]])
+        data["lifetime"] = (data["merged_at"] - data["opened_at"]) // timedelta64(1, "M")
+        partials.append(data.query("lifetime >= 0").value_counts("lifetime"))
+    return concat(partials).groupby(level="lifetime").sum().rename("frequency").reset_index().assign(project=project)
+
+
+def load_lifetimes(project):
+    if (file := paths("lifetimes", project)).exists() and file.stat().st_mtime >= paths(
+        "dataset_pulls", project
+    ).stat().st_mtime:
+        return import_lifetimes(project)
+    export_lifetimes(project, lifetimes := count_lifetimes(project))
+    return lifetimes
+
+
+def summarize_lifetimes(lifetimes, groups=None):
+    if groups is None:
+        groups = []
+    data = lifetimes.groupby([*groups, "lifetime"])["frequency"].sum().reset_index()
+    if groups:
+        data["pdf"] = data["frequency"] / data.groupby(groups)["frequency"].transform("sum")
+        data["cdf"] = data.groupby(groups)["pdf"].cumsum()
+    else:
+        data["pdf"] = data["frequency"] / sum(data["frequency"])
+        data["cdf"] = data["pdf"].cumsum()
+    return data
+
+
+def export_lifetimes(project, lifetimes):
+    lifetimes.to_csv(paths("lifetimes", project), index=False)
+
+
+def export_inactivity(inactivity, file="inactivity"):
+    inactivity.to_csv(paths(file), index=False)
 
 
 def analyze_inactivity():
     log.info("Analyzing inactivity")
-    data = concat(
-        [
-            import_dataset(project).query("event == 'pulled' and merged and not core")[["opened_at", "merged_at"]]
-            for project in postprocessed()
-        ]
-    )
-    data["lifetime"] = (data["merged_at"] - data["opened_at"]) // timedelta64(1, "M")
-    data = data.query("lifetime >= 0").value_counts("lifetime", sort=False).to_frame("frequency").reset_index()
-    data["pdf"] = data["frequency"] / sum(data["frequency"])
-    data["cdf"] = data["pdf"].cumsum()
-    export_inactivity(data)
+    lifetimes = concat([load_lifetimes(project) for project in postprocessed()])
+    export_inactivity(summarize_lifetimes(lifetimes))
+    export_inactivity(summarize_lifetimes(lifetimes, ["project"]), "inactivity_projects")
 
 
 def main():
-    if cleanup("inactivity", refresh()):
+    if cleanup(["inactivity", "inactivity_projects"], refresh()):
         analyze_inactivity()
     else:
         print("Skip analyzing inactivity")
@@ -0,0 +1,86 @@
+from json import dumps, loads
+from time import perf_counter
+
+from pandas import DataFrame
+from zstandard import ZstdCompressor, ZstdDecompressor, train_dictionary
+
+from common import DICTIONARY, SAMPLES, cleanup, collected, initialize, logger, paths, persist, prune, refresh
+
+initialize()
+log = logger(__file__, modules={"sqlitedict": "WARNING"})
+ROWS = 10_000
+
+
+def encode_json(rows):
+    return [dumps(row, ensure_ascii=False, separators=(",", ":")).encode() for row in rows]
+
+
+def encode_zstd(samples, rows):
+    compressor = ZstdCompressor(dict_data=(dictionary := train_dictionary(DICTIONARY, samples)))
+    return [compressor.compress(row) for row in rows], ZstdDecompressor(dict_data=dictionary).decompress
+
+
+def measure_decoding(blobs, decompress=None):
+    start = perf_counter()
+    for blob in blobs:
+        loads(decompress(blob) if decompress is not None else blob)
+    return perf_counter() - start
+
+
+def benchmark_storage(project, table):
+    log.info(f"{project}: Benchmarking storage of {table}")
+    with persist(paths(table, project)) as database:
+        rows = [row for _, row in zip(range(SAMPLES + ROWS), database.values())]
+    if len(rows) <= SAMPLES:
+        log.warning(f"{project}: Skip benchmarking storage of {table} with only {len(rows)} rows")
+        return []
+    plain = encode_json(rows)
+    pruned = encode_json([prune(row) for row in rows])
+    size = sum(len(row) for row in plain[SAMPLES:])
+    benchmarks = []
+    for encoding, blobs, decompress in [
+        ("json", plain[SAMPLES:], None),
+        ("json_pruned", pruned[SAMPLES:], None),
+        ("zstd", *encode_zstd(plain[:SAMPLES], plain[SAMPLES:])),
+        ("zstd_pruned", *encode_zstd(pruned[:SAMPLES], pruned[SAMPLES:])),
+    ]:
+        seconds = measure_decoding(blobs, decompress)
+        benchmarks.append(
+            {
+                "project": project,
+                "table": table,
+                "encoding": encoding,
+                "rows": len(blobs),
+                "bytes": (encoded := sum(len(blob) for blob in blobs)),
+                "ratio": size / encoded,
+                "decode_rows_per_second": len(blobs) / seconds,
+                "decode_megabytes_per_second": size / 2**20 / seconds,
+            }
+        )
+    return benchmarks
+
+
+def export_storage(benchmarks):
+    DataFrame(benchmarks).to_csv(paths("storage"), index=False)
+
+
+def main():
+    if cleanup("storage", refresh()):
+        export_storage(
+            [
+                benchmark
+                for project in collected()
+                for table in ["timelines_raw", "files"]
+                for benchmark in benchmark_storage(project, table)
+            ]
+        )
+    else:
+        print("Skip benchmarking storage")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Stop benchmarking storage")
+        exit(1)
@@ -1,67 +1,162 @@
-from joblib import Parallel, delayed
-from keras import Sequential
-from keras.layers import Dense
-from pandas import DataFrame, read_csv
-from scikeras.wrappers import KerasClassifier
-from sklearn.model_selection import RepeatedStratifiedKFold, cross_val_score
-from sklearn.preprocessing import StandardScaler
-from tensorflow.keras.utils import set_random_seed
+from itertools import product
+from json import dumps
 
-from common import cleanup, initialize, logger, measured, paths, refresh
+from joblib import Parallel, delayed, dump
+from numpy import argmax, array, nan, nan_to_num, zeros
+from pandas import DataFrame
+
+from common import EXCLUDED, cleanup, import_matrix, initialize, logger, measured, paths, refresh, search
 
 initialize()
+CONFIGURATIONS = [
+    {"units": units, "dropout": dropout, "learning_rate": learning_rate, "batch_size": batch_size}
+    for units, dropout, learning_rate, batch_size in product(
+        [(11, 6), (32, 16), (32, 16, 8)], [0.0, 0.2, 0.4], [0.001, 0.003, 0.01], [32]
+    )
+]
+FOLDS = 5
+ETA = 3
+BUDGET = 100
+PATIENCE = 2
+VALIDATION = 0.2
 
 
 def import_features(project):
-    file = paths("features", project)
-    return read_csv(
-        file,
-        usecols=[
-            column
-            for column in read_csv(file, nrows=0)
-            if column
-            not in [
-                "project",
-                "pull_number",
-                "open",
-                "closed",
-                "merged",
-                "pr_changed_files",
-                "pr_lifetime",
-                "contributor_contribution_period",
-                "review_participants",
-                "review_responses_interval",
-                "project_pulls",
-                "project_contributors",
-            ]
-        ],
+    matrix, labels, schema = import_matrix(project)
+    indices = [index for index, column in enumerate(schema["columns"]) if column not in EXCLUDED]
+    return (
+        matrix[:, indices],
+        labels.astype("float32"),
+        [schema["columns"][index] for index in indices],
+        array(schema["mean"], dtype="float32")[indices],
+        array(schema["scale"], dtype="float32")[indices],
     )
 
 
-def create_model():
-    model = Sequential(
-        [
-            Dense(11, activation="relu", input_dim=11),
-            Dense(6, activation="relu"),
-            Dense(1, activation="sigmoid"),
-        ]
-    )
-    model.compile(optimizer="Adam", loss="binary_crossentropy")
+def create_model(units=(11, 6), dropout=0.0, learning_rate=0.001, meta=None):
+    from keras import Sequential
+    from keras.layers import Dense, Dropout
+    from keras.metrics import AUC
+    from keras.optimizers import Adam
+
+    layers = [Dense(units[0], activation="relu", input_dim=meta["n_features_in_"] if meta else 11)]
+    for unit in units[1:]:
+        layers += [Dropout(dropout), Dense(unit, activation="relu")] if dropout else [Dense(unit, activation="relu")]
+    model = Sequential(layers + [Dense(1, activation="sigmoid")])
+    model.compile(optimizer=Adam(learning_rate=learning_rate), loss="binary_crossentropy", metrics=[AUC(name="auc")])
     return model
 
 
-def build_deeplearning(project):
+def create_classifier(configuration=None, stopping=False):
+    from keras.callbacks import EarlyStopping
+    from scikeras.wrappers import KerasClassifier
+
+    if configuration is None:
+        return KerasClassifier(create_model, verbose=0)
+    training = {"epochs": configuration["epochs"]}
+    if stopping:
+        training.update(
+            validation_split=VALIDATION,
+            callbacks=[EarlyStopping(monitor="val_auc", mode="max", patience=PATIENCE, restore_best_weights=True)],
+        )
+    return KerasClassifier(
+        create_model,
+        model__units=configuration["units"],
+        model__dropout=configuration["dropout"],
+        model__learning_rate=configuration["learning_rate"],
+        batch_size=configuration["batch_size"],
+        verbose=0,
+        **training,
+    )
+
+
+def schedule(count):
+    rungs = []
+    while count > 1:
+        rungs.append((count, ETA ** len(rungs)))
+        count = -(-count // ETA)
+    return rungs
+
+
+def split_folds(project):
+    from sklearn.model_selection import StratifiedKFold
+
+    y = import_features(project)[1]
+    return list(StratifiedKFold(n_splits=FOLDS, shuffle=True, random_state=1).split(zeros(len(y)), y))
+
+
+def evaluate_configuration(project, configuration, train, test):
+    from sklearn.metrics import roc_auc_score
+    from tensorflow.keras.utils import set_random_seed
+
+    set_random_seed(1)
+    X, y, columns, mean, scale = import_features(project)
+    X = (X - mean) / scale
+    classifier = create_classifier(configuration, stopping=True).fit(X[train], y[train])
+    epochs = int(argmax(classifier.history_["val_auc"])) + 1
+    try:
+        return roc_auc_score(y[test], classifier.predict_proba(X[test])[:, 1]), epochs
+    except ValueError:
+        return nan, epochs
+
+
+def search_configurations(projects, parallel):
+    log = logger(__file__)
+    rungs = schedule(len(CONFIGURATIONS))
+    if (cost := sum(count * epochs for count, epochs in rungs)) > BUDGET:
+        raise RuntimeError(f"Searching {len(CONFIGURATIONS)} configurations needs {cost} of {BUDGET} epochs")
+    folds = {project: split_folds(project) for project in projects}
+    candidates = {project: list(range(len(CONFIGURATIONS))) for project in projects}
+    results = {}
+    for rung, (_, epochs) in enumerate(rungs):
+        log.info(f"Evaluating {sum(map(len, candidates.values()))} configurations for {epochs} epochs")
+        trials = [(project, candidate) for project in projects for candidate in candidates[project]]
+        results = dict(
+            zip(
+                trials,
+                parallel(
+                    delayed(evaluate_configuration)(
+                        project, {**CONFIGURATIONS[candidate], "epochs": epochs}, *folds[project][rung % FOLDS]
+                    )
+                    for project, candidate in trials
+                ),
+            )
+        )
+        for project in projects:
+            candidates[project] = sorted(
+                candidates[project],
+                key=lambda candidate: nan_to_num(results[project, candidate][0], nan=-1.0),
+                reverse=True,
+            )[: -(-len(candidates[project]) // ETA)]
+    configurations = {}
+    for project in projects:
+        best = candidates[project][0]
+        configurations[project] = {**CONFIGURATIONS[best], "epochs": results[project, best][1]}
+    return configurations
+
+
+def build_deeplearning(project, configuration=None):
+    from sklearn.model_selection import RepeatedStratifiedKFold, cross_val_score
+    from tensorflow.keras.utils import set_random_seed
+
     log = logger(__file__)
     log.info(f"{project}: Building deep learning model")
     set_random_seed(1)
-    features = import_features(project).values
-    X = features[:, 1:].astype(float)
-    y = features[:, 0].astype(float)
-    X = StandardScaler().fit(X).transform(X)
+    X, y, columns, mean, scale = import_features(project)
+    export_model(project, columns, X, y, configuration)
+    X = (X - mean) / scale
     results = cross_val_score(
-        KerasClassifier(create_model), X, y, scoring="roc_auc", cv=RepeatedStratifiedKFold(n_splits=10)
+        create_classifier(configuration), X, y, scoring="roc_auc", cv=RepeatedStratifiedKFold(n_splits=10)
     )
-    return {"project": project, "auc": results.mean()}
+    return {"project": project, "auc": results.mean(), "configuration": dumps(configuration)}
+
+
+def export_model(project, columns, X, y, configuration=None):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    model = make_pipeline(StandardScaler(), create_classifier(configuration)).fit(X, y)
+    dump({"columns": columns, "model": model}, paths("model", project))
 
 
 def export_scores(scores):
@@ -70,8 +165,12 @@ def export_scores(scores):
 
 def main():
     if cleanup("deeplearning", refresh()):
+        projects = measured()
         with Parallel(n_jobs=-1) as parallel:
-            export_scores(parallel(delayed(build_deeplearning)(project) for project in measured()))
+            configurations = search_configurations(projects, parallel) if search() else {}
+            export_scores(
+                parallel(delayed(build_deeplearning)(project, configurations.get(project)) for project in projects)
+            )
     else:
         print("Skip building deep learning models")
 
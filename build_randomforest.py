@@ -0,0 +1,147 @@
+from json import loads
+from os import replace
+
+from joblib import Parallel, delayed, dump
+from numpy import array, asarray, load, median, nan, save, unique, zeros
+from numpy.random import default_rng
+from pandas import DataFrame
+
+from common import EXCLUDED, cleanup, import_matrix, initialize, logger, measured, paths, refresh
+
+initialize()
+log = logger(__file__)
+TREES = 500
+FOLDS = 10
+REPETITIONS = 10
+PERMUTATIONS = 100
+
+
+def select_columns(schema):
+    return [index for index, column in enumerate(schema["columns"]) if column not in EXCLUDED]
+
+
+def import_features(project):
+    schema = loads(paths("schema", project).read_text())
+    return (
+        load(paths("forest_matrix", project), mmap_mode="r"),
+        load(paths("forest_targets", project), mmap_mode="r"),
+        [schema["columns"][index] for index in select_columns(schema)],
+    )
+
+
+def export_features(project):
+    matrix, labels, schema = import_matrix(project)
+    rows = (asarray(matrix) >= 0).all(axis=1)
+    for file, data in [
+        ("forest_matrix", asarray(matrix)[rows][:, select_columns(schema)]),
+        ("forest_targets", asarray(labels)[rows]),
+    ]:
+        temporary = (file := paths(file, project)).with_name(f"{file.name}.tmp")
+        with open(temporary, "wb") as output:
+            save(output, data)
+        replace(temporary, file)
+
+
+def create_model():
+    from sklearn.ensemble import RandomForestClassifier
+
+    return RandomForestClassifier(n_estimators=TREES, random_state=1)
+
+
+def split_folds(project):
+    from sklearn.model_selection import RepeatedStratifiedKFold
+
+    y = import_features(project)[1]
+    return RepeatedStratifiedKFold(n_splits=FOLDS, n_repeats=REPETITIONS, random_state=1).split(zeros(len(y)), y)
+
+
+def evaluate_fold(project, train, test):
+    from sklearn.metrics import average_precision_score, roc_auc_score
+
+    X, y, columns = import_features(project)
+    if len(unique(y[train])) < 2 or len(unique(y[test])) < 2:
+        return {"project": project, "auc-roc": nan, "auc-pr": nan, "ratio": y.mean()}
+    probabilities = create_model().fit(X[train], y[train]).predict_proba(X[test])[:, 1]
+    return {
+        "project": project,
+        "auc-roc": roc_auc_score(y[test], probabilities),
+        "auc-pr": average_precision_score(y[test], probabilities),
+        "ratio": y.mean(),
+    }
+
+
+def train_forest(project):
+    log.info(f"{project}: Training random forest")
+    X, y, columns = import_features(project)
+    dump(create_model().fit(X, y), paths("forest", project))
+    return columns
+
+
+def permute_feature(project, feature):
+    from joblib import load
+    from sklearn.metrics import roc_auc_score
+
+    X, y, columns = import_features(project)
+    model = load(paths("forest", project))
+    error = 1 - roc_auc_score(y, model.predict_proba(X)[:, 1])
+    permuted = array(X)
+    generator = default_rng(feature)
+    errors = []
+    for _ in range(PERMUTATIONS):
+        permuted[:, feature] = generator.permutation(X[:, feature])
+        errors.append(1 - roc_auc_score(y, model.predict_proba(permuted)[:, 1]))
+    if error:
+        return project, columns[feature], median(errors) / error
+    log.warning(f"{project}: Comparing difference for feature {columns[feature]} because model error is zero")
+    return project, columns[feature], median(errors) - error
+
+
+def export_performance(folds):
+    DataFrame(folds).groupby("project", sort=False).mean().reset_index().to_csv(
+        paths("forest_performance"), index=False
+    )
+
+
+def export_importance(importances):
+    importance = {}
+    for project, feature, value in importances:
+        importance.setdefault(project, {})[feature] = value
+    DataFrame(importance).rename_axis("feature").reset_index().to_csv(paths("forest_importance"), index=False)
+
+
+def build_randomforest(projects):
+    for project in projects:
+        export_features(project)
+    with Parallel(n_jobs=-1) as parallel:
+        log.info(f"Evaluating random forests for {len(projects)} projects")
+        export_performance(
+            parallel(
+                delayed(evaluate_fold)(project, train, test)
+                for project in projects
+                for train, test in split_folds(project)
+            )
+        )
+        features = parallel(delayed(train_forest)(project) for project in projects)
+        log.info(f"Analyzing feature importance for {len(projects)} projects")
+        export_importance(
+            parallel(
+                delayed(permute_feature)(project, feature)
+                for project, columns in zip(projects, features)
+                for feature in range(len(columns))
+            )
+        )
+
+
+def main():
+    if cleanup(["forest_performance", "forest_importance"], refresh()):
+        build_randomforest(measured())
+    else:
+        print("Skip building random forests")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Stop building random forests")
+        exit(1)
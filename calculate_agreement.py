@@ -1,49 +1,125 @@
-from pandas import DataFrame, concat, notna, read_excel
-from sklearn.metrics import cohen_kappa_score
+from functools import reduce
+from itertools import combinations
+from operator import or_
+
+from joblib import Parallel, delayed
+from numpy import arange, concatenate, percentile, select, stack
+from numpy.random import default_rng
+from pandas import DataFrame, ExcelFile, concat, factorize, read_excel
 
 from common import cleanup, initialize, logger, paths, refresh
 
 initialize()
 log = logger(__file__)
+RESAMPLES = 1000
+BATCH = 100
+CONFIDENCE = 95
+
+
+def group_sheets(sheets):
+    raters = []
+    for sheet, labels in sheets.items():
+        for rater in raters:
+            if all(labels.index.intersection(sheets[other].index).empty for other in rater):
+                rater.append(sheet)
+                break
+        else:
+            raters.append([sheet])
+    return raters
+
+
+def deduplicate(rater, labels):
+    if (duplicated := labels.index.duplicated()).any():
+        log.warning(f"Dropping {duplicated.sum()} duplicate labels of {rater}")
+    return labels[~duplicated]
 
 
 def import_labels():
-    return read_excel(
-        paths("labels"),
-        sheet_name=["Hassan", "Diego", "Rabe"],
-        index_col=[0, 1],
-        usecols=["Project", "ID", "First Reason", "Second Reason"],
+    with ExcelFile(paths("labels")) as workbook:
+        sheets = read_excel(
+            workbook,
+            sheet_name=workbook.sheet_names,
+            index_col=[0, 1],
+            usecols=["Project", "ID", "First Reason", "Second Reason"],
+        )
+    raters = group_sheets(sheets)
+    return ["+".join(rater) for rater in raters], [
+        deduplicate("+".join(rater), concat([sheets[sheet] for sheet in rater])) for rater in raters
+    ]
+
+
+def agrees(label, labels):
+    return label.notna() & (label.eq(labels["First Reason"]) | label.eq(labels["Second Reason"]))
+
+
+def reconcile(reference, others):
+    others = [other.reindex(reference.index) for other in others]
+    first, second = reference["First Reason"], reference["Second Reason"]
+    label = first.where(
+        reduce(or_, [agrees(first, other) for other in others])
+        | ~reduce(or_, [agrees(second, other) for other in others]),
+        second,
     )
+    labels = [label] + [
+        select(
+            [agrees(label, other), agrees(first, other), agrees(second, other), other["First Reason"].notna()],
+            [label, first, second, other["First Reason"]],
+            other["Second Reason"],
+        )
+        for other in others
+    ]
+    labels = DataFrame(stack(labels), index=range(len(labels)), columns=reference.index).T.dropna()
+    codes, categories = factorize(labels.to_numpy().ravel())
+    return codes.reshape(labels.shape).T, len(categories)
 
 
-def fill_common(row):
-    first_hassan = row["First Reason Hassan"]
-    second_hassan = row["Second Reason Hassan"]
-    first_diego = row["First Reason Diego"]
-    second_diego = row["Second Reason Diego"]
-    if first_hassan in [first_diego, second_diego]:
-        row["first"] = row["second"] = first_hassan
-    elif notna(second_hassan) and second_hassan in [first_diego, second_diego]:
-        row["first"] = row["second"] = second_hassan
-    elif notna(first_diego):
-        row["first"] = first_hassan
-        row["second"] = first_diego
-    elif notna(second_diego):
-        row["first"] = first_hassan
-        row["second"] = second_diego
-    return row[["first", "second"]]
+def count(codes, categories):
+    return (codes[..., None] == arange(categories)).sum(axis=0)
+
+
+def cohen_kappa(codes, categories):
+    observed = (codes[0] == codes[1]).mean(axis=-1)
+    marginals = count(codes[:1], categories).sum(axis=-2) * count(codes[1:], categories).sum(axis=-2)
+    expected = marginals.sum(axis=-1) / codes.shape[-1] ** 2
+    return (observed - expected) / (1 - expected)
+
+
+def fleiss_kappa(codes, categories):
+    raters, items = codes.shape[0], codes.shape[-1]
+    counts = count(codes, categories)
+    observed = ((counts**2).sum(axis=-1) - raters).mean(axis=-1) / (raters * (raters - 1))
+    expected = ((counts.sum(axis=-2) / (items * raters)) ** 2).sum(axis=-1)
+    return (observed - expected) / (1 - expected)
+
+
+def resample(measure, codes, categories, seed):
+    return measure(codes[:, default_rng(seed).integers(0, codes.shape[-1], (BATCH, codes.shape[-1]))], categories)
+
+
+def measure_agreement(parallel, measure, codes, categories):
+    scores = concatenate(
+        parallel(delayed(resample)(measure, codes, categories, seed) for seed in range(RESAMPLES // BATCH))
+    )
+    lower, upper = percentile(scores, [(100 - CONFIDENCE) / 2, (100 + CONFIDENCE) / 2])
+    return measure(codes, categories), lower, upper
 
 
-def export_score(score):
-    DataFrame({"score": [score]}).to_csv(paths("agreement"), index=False)
+def export_scores(scores):
+    DataFrame(scores, columns=["measure", "raters", "score", "lower", "upper"]).to_csv(paths("agreement"), index=False)
 
 
 def calculate_agreement():
     log.info("Calculating agreement")
-    hassan, diego, rabe = import_labels().values()
-    labels = hassan.join(concat([rabe, diego]), lsuffix=" Hassan", rsuffix=" Diego")
-    labels[["first", "second"]] = labels.apply(fill_common, axis="columns")
-    export_score(cohen_kappa_score(labels["first"], labels["second"]))
+    raters, labels = import_labels()
+    scores = []
+    with Parallel(n_jobs=-1) as parallel:
+        for first, second in combinations(range(len(raters)), 2):
+            codes, categories = reconcile(labels[first], [labels[second]])
+            score = measure_agreement(parallel, cohen_kappa, codes, categories)
+            scores.append(["cohen", f"{raters[first]},{raters[second]}", *score])
+        codes, categories = reconcile(labels[0], labels[1:])
+        scores.append(["fleiss", ",".join(raters), *measure_agreement(parallel, fleiss_kappa, codes, categories)])
+    export_scores(scores)
 
 
 def main():
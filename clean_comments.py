@@ -0,0 +1,116 @@
+from csv import QUOTE_ALL
+
+from joblib import Parallel, delayed
+from pandas import concat, read_csv
+
+from common import (
+    chunk,
+    cleanup,
+    exist,
+    fingerprint,
+    incremental,
+    initialize,
+    logger,
+    paths,
+    preprocessed,
+    refresh,
+    resume,
+    store,
+)
+
+initialize()
+log = logger(__file__)
+EVENTS = ["commented"]
+
+
+def import_timelines(project):
+    timelines = read_csv(
+        paths("timelines_preprocessed", project),
+        index_col=["pull_number", "event_number"],
+        usecols=["pull_number", "event_number", "event", "body"],
+        dtype={"event": "category", "body": "string"},
+        quoting=QUOTE_ALL,
+    )
+    return timelines.loc[timelines["event"].isin(EVENTS), "body"].dropna()
+
+
+def import_comments(project):
+    return read_csv(
+        paths("comments", project),
+        index_col=["pull_number", "event_number"],
+        dtype={"body": "string"},
+        keep_default_na=False,
+    ).squeeze("columns")
+
+
+def import_fingerprints(project):
+    return read_csv(paths("comment_fingerprints", project), index_col="pull_number").squeeze("columns")
+
+
+def clean_chunk(bodies):
+    return (
+        bodies.str.replace(r"(?s)(?:(?<!\\)((?:\\{2})+)(?=`+)|(?<!\\)(`+)(.+?)(?<!`)\2(?!`))", "", regex=True)
+        .str.replace(r"(?m)^>.*?$", "", regex=True)
+        .str.lower()
+    )
+
+
+def export_fingerprints(project, fingerprints):
+    store(paths("comment_fingerprints", project), fingerprints)
+
+
+def clean_comments(project):
+    log.info(f"{project}: Cleaning comments")
+    bodies = import_timelines(project)
+    with Parallel(n_jobs=-1) as parallel:
+        resume(
+            "comments",
+            project,
+            clean_chunk,
+            chunk(bodies.index.unique("pull_number")),
+            load=lambda pull_numbers: bodies.loc[pull_numbers],
+            parallel=parallel,
+        )
+    export_fingerprints(project, fingerprint(bodies))
+
+
+def update_comments(project):
+    bodies = import_timelines(project)
+    fingerprints = fingerprint(bodies)
+    previous = import_fingerprints(project)
+    changed = fingerprints.index[fingerprints.ne(previous.reindex(fingerprints.index))]
+    removed = previous.index.difference(fingerprints.index)
+    if changed.empty and removed.empty:
+        log.info(f"{project}: Cleaned comments are up to date")
+        return
+    log.info(f"{project}: Cleaning comments for {len(changed)} changed and {len(removed)} removed pull requests")
+    with Parallel(n_jobs=-1) as parallel:
+        chunks = parallel(delayed(clean_chunk)(bodies.loc[pull_numbers]) for pull_numbers in chunk(changed))
+    comments = import_comments(project)
+    comments = comments[~comments.index.get_level_values("pull_number").isin(changed.union(removed))]
+    store(paths("comments", project), concat([comments, *chunks]).sort_index())
+    export_fingerprints(project, fingerprints)
+
+
+def main():
+    projects = []
+    updates = []
+    for project in preprocessed():
+        if incremental() and exist(["comments", "comment_fingerprints"], project):
+            updates.append(project)
+        elif cleanup(["comments", "comment_fingerprints"], refresh(), project):
+            projects.append(project)
+        else:
+            print(f"Skip cleaning comments for project {project}")
+    for project in projects:
+        clean_comments(project)
+    for project in updates:
+        update_comments(project)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Stop cleaning comments")
+        exit(1)
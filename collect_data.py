@@ -1,11 +1,39 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from threading import Event, Thread
+from time import perf_counter, sleep
+
 from github import BadCredentialsException, GithubException, RateLimitExceededException, UnknownObjectException
 from joblib import Parallel, delayed
 from requests.exceptions import RetryError
 
-from common import TOKENS, cleanup, github, initialize, logger, paths, persist, refresh, tocollect
+from common import (
+    TOKENS,
+    cleanup,
+    compact,
+    coordinate,
+    estimates,
+    github,
+    initialize,
+    logger,
+    paths,
+    persist,
+    refresh,
+    tocollect,
+    work,
+)
+from jobs import complete_job, enqueue_jobs, identify_worker, lease_job, release_jobs, remaining_jobs, renew_job
+from telemetry import count, observe_quota, record_pull, record_write, start_telemetry, stop_telemetry, track_project
 
 initialize()
 log = logger(__file__, modules={"sqlitedict": "WARNING", "urllib3": "ERROR"})
+WORKERS = 12
+PREFETCH = 8
+PRUNE = False
+PAGE = 100
+RANGE = 5000
+HEARTBEAT = 60
 
 
 def delete_pull(databases, pull):
@@ -18,39 +46,106 @@ def delete_pull(databases, pull):
             pass
 
 
-def collect_data(project):
+def fetch_pull(executor, repository, pull, exclude):
+    if pull.number in exclude:
+        return []
+    return [
+        executor.submit(lambda: [event.data for event in repository.get_issue(pull.number).get_timeline()]),
+        executor.submit(lambda: {commit.data["sha"]: commit.data for commit in pull.get_commits()}),
+        executor.submit(lambda: {file.data["sha"]: file.data for file in pull.get_files()}),
+    ]
+
+
+def prefetch_pulls(executor, repository, pulls, exclude):
+    pending = deque()
+    try:
+        for pull in pulls:
+            pending.append((pull, fetch_pull(executor, repository, pull, exclude)))
+            if len(pending) > PREFETCH:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for pull, futures in pending:
+            for future in futures:
+                future.cancel()
+
+
+def locate_page(listing, number):
+    low, high = 0, ceil(listing.totalCount / PAGE)
+    while low < high:
+        middle = (low + high) // 2
+        if (page := listing.get_page(middle)) and page[-1].number < number:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def list_pulls(repository, low, high, after):
+    listing = repository.get_pulls(state="all", direction="asc")
+    number = locate_page(listing, start) if (start := max(low, after + 1)) > 1 else 0
+    while pulls := listing.get_page(number):
+        for pull in pulls:
+            if high is not None and pull.number >= high:
+                return
+            if pull.number >= start:
+                yield pull
+        number += 1
+
+
+def collect_range(project, low=0, high=None, stop=None):
     paths("directory", project).mkdir(parents=True, exist_ok=True)
     checkpoint = persist(paths("checkpoint", project))
     pulls = persist(paths("pulls_raw", project))
-    timelines = persist(paths("timelines_raw", project))
+    timelines = persist(paths("timelines_raw", project), compress=True, pruned=PRUNE)
     commits = persist(paths("commits", project))
-    files = persist(paths("files", project))
+    files = persist(paths("files", project), compress=True, pruned=PRUNE)
     metadata = persist(paths("metadata", project))
-    if checkpoint.get("last") is None:
-        checkpoint["last"] = 0
-        checkpoint["exclude"] = []
+    key, exclude = f"range_{low}", f"exclude_{low}"
+    if checkpoint.get(exclude) is None:
+        checkpoint[exclude] = []
+    if checkpoint.get(key) is None:
+        checkpoint[key] = 0
     else:
-        log.info(f"{project}: Last collected data is for pull request {checkpoint.get('pull')}")
+        log.info(f"{project}: Last collected data from pull request {low} is for pull request {checkpoint[key]}")
+    track_project(project, len(pulls))
     token, client = github()
+    executor = ThreadPoolExecutor(WORKERS)
+    finished = False
     while True:
         try:
-            log.info(f"{project}: Collecting list of pull requests")
+            log.info(f"{project}: Collecting list of pull requests from pull request {low}")
             repository = client.get_repo(project)
-            for pull in repository.get_pulls(state="all", direction="asc")[checkpoint["last"] :]:
+            for pull, futures in prefetch_pulls(
+                executor, repository, list_pulls(repository, low, high, checkpoint[key]), checkpoint[exclude]
+            ):
+                if stop is not None and stop.is_set():
+                    break
+                observe_quota(token, client)
                 if client.rate_limiting[0] <= TOKENS[token]:
                     raise RateLimitExceededException(403, f"Reached custom rate limit for token {token}", headers=None)
-                if (pull_number := pull.number) in checkpoint["exclude"]:
+                if (pull_number := pull.number) in checkpoint[exclude]:
                     log.info(f"{project}: Deleting data for pull request {pull_number}")
                     delete_pull([pulls, timelines, commits, files], pull_number)
                 else:
                     log.info(f"{project}: Collecting data for pull request {pull_number}")
+                    timeline, pull_commits, pull_files = [future.result() for future in futures]
+                    start = perf_counter()
                     pulls[pull_number] = pull.data
-                    timelines[pull_number] = [event.data for event in repository.get_issue(pull_number).get_timeline()]
-                    commits[pull_number] = {commit.data["sha"]: commit.data for commit in pull.get_commits()}
-                    files[pull_number] = {file.data["sha"]: file.data for file in pull.get_files()}
-                checkpoint["pull"] = pull_number
-                checkpoint["last"] += 1
+                    timelines[pull_number] = timeline
+                    commits[pull_number] = pull_commits
+                    files[pull_number] = pull_files
+                    for database in [pulls, timelines, commits, files]:
+                        database.commit()
+                    record_write(perf_counter() - start)
+                    record_pull(project)
+                checkpoint[key] = pull_number
+            else:
+                metadata.update(repository.data)
+                finished = True
         except (BadCredentialsException, RateLimitExceededException):
+            count("rotations")
             token, client = github(token)
         except UnknownObjectException:
             log.warning(f"{project}: Project does not exist")
@@ -59,19 +154,92 @@ def collect_data(project):
             if (isinstance(exception, GithubException) and exception.status == 422) or isinstance(
                 exception, RetryError
             ):
+                count("unprocessable" if isinstance(exception, GithubException) else "retry_errors")
+                count("excluded")
                 log.warning(f"{project}: Skip collecting data for pull request {pull_number} due to {exception}")
-                checkpoint["exclude"] = [*checkpoint["exclude"], pull_number]
+                checkpoint[exclude] = [*checkpoint[exclude], pull_number]
             else:
+                count("errors")
                 log.error(f"{project}: Failed collecting data due to {exception}")
         else:
-            metadata.update(repository.data)
-            checkpoint.terminate()
-            log.info(f"{project}: Finished collecting data")
             break
+    for database in [checkpoint, pulls, timelines, commits, files, metadata]:
+        database.close()
+    executor.shutdown(cancel_futures=True)
     github(token, done=True)
+    return finished
 
 
-def main():
+def finish_project(project):
+    for file in ["timelines_raw", "files"]:
+        compact(paths(file, project), PRUNE)
+    persist(paths("checkpoint", project)).terminate()
+    log.info(f"{project}: Finished collecting data")
+
+
+def split_project(project, pulls=0):
+    token, client = github()
+    while True:
+        try:
+            last = next(iter(client.get_repo(project).get_pulls(state="all", direction="desc")), None)
+        except (BadCredentialsException, RateLimitExceededException):
+            count("rotations")
+            token, client = github(token)
+        except UnknownObjectException:
+            log.warning(f"{project}: Project does not exist")
+            last = None
+            break
+        except Exception as exception:
+            count("errors")
+            log.error(f"{project}: Failed listing pull requests due to {exception}")
+        else:
+            break
+    github(token, done=True)
+    if last is None:
+        return [(0, None, pulls)]
+    bounds = list(range(0, last.number + 1, RANGE))
+    return [
+        (low, high, ceil(pulls * (min(high or last.number + 1, last.number + 1) - low) / (last.number + 1)))
+        for low, high in zip(bounds, [*bounds[1:], None])
+    ]
+
+
+def coordinate_project(project, pulls=0):
+    reset = not paths("checkpoint", project).exists()
+    paths("directory", project).mkdir(parents=True, exist_ok=True)
+    persist(paths("checkpoint", project)).close()
+    enqueue_jobs(project, ranges := split_project(project, pulls), reset)
+    log.info(f"{project}: Queued {len(ranges)} collection jobs")
+
+
+def renew_lease(worker, project, low, high, stop):
+    while not stop.wait(HEARTBEAT):
+        if not renew_job(worker, project, low, high):
+            log.warning(f"{project}: Lost lease or bounds for collection job from pull request {low}")
+            stop.set()
+
+
+def work_jobs():
+    worker = identify_worker()
+    while True:
+        if (job := lease_job(worker)) is None:
+            if not remaining_jobs():
+                break
+            sleep(HEARTBEAT)
+            continue
+        project, low, high = job
+        stop = Event()
+        heartbeat = Thread(target=renew_lease, args=(worker, project, low, high, stop), daemon=True)
+        heartbeat.start()
+        finished = collect_range(project, low, high, stop)
+        lost = stop.is_set()
+        stop.set()
+        heartbeat.join()
+        if not lost and complete_job(worker, project, low, "done" if finished else "failed"):
+            finish_project(project)
+
+
+def select_projects():
     projects = []
     for project in tocollect():
         if (
@@ -81,8 +249,22 @@ def main():
             projects.append(project)
         else:
             print(f"Skip collecting data for project {project}")
-    with Parallel(n_jobs=len(TOKENS), prefer="threads") as parallel:
-        parallel(delayed(collect_data)(project) for project in projects)
+    return projects
+
+
+def main():
+    stop = start_telemetry()
+    try:
+        with Parallel(n_jobs=len(TOKENS), prefer="threads") as parallel:
+            if not work():
+                if not coordinate():
+                    release_jobs()
+                pulls = estimates()
+                parallel(delayed(coordinate_project)(project, pulls.get(project, 0)) for project in select_projects())
+            if not coordinate():
+                parallel(delayed(work_jobs)() for _ in TOKENS)
+    finally:
+        stop_telemetry(stop)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,21 @@
 from argparse import ArgumentParser
+from contextlib import closing
 from functools import reduce
+from itertools import groupby
 from json import dumps, loads
 from logging import getLogger
 from logging.config import dictConfig
-from os import chdir
+from os import chdir, replace
 from pathlib import Path
 from queue import Queue
+from shutil import copyfileobj, rmtree
+from sqlite3 import connect
 from sys import maxsize, setrecursionlimit, version_info
 
-from github import BadCredentialsException, Github, GithubObject, RateLimitExceededException
-from pandas import Timestamp, read_csv
-from sqlitedict import SqliteDict
-from urllib3.util.retry import Retry
+from joblib import delayed
+from numpy import arange, load, select, zeros
+from pandas import Categorical, DataFrame, Series, Timedelta, Timestamp, read_csv, to_datetime
+from pandas.util import hash_pandas_object
 
 log = getLogger(__name__)
 DATE = Timestamp(2020, 5, 30)
@@ -31,8 +35,26 @@ KEYWORDS = [
     "lack of response",
     "no response",
 ]
+PRUNED = ["node_id", "gravatar_id", "patch", "reactions", "performed_via_github_app"]
+SAMPLES = 1000
+CHUNK = 1000
+DICTIONARY = 112_640
+STRINGS = ["event", "actor", "author_association"]
+TIMES = ["time", "opened_at", "closed_at", "merged_at", "contributor_first"]
+EXCLUDED = [
+    "pr_changed_files",
+    "pr_lifetime",
+    "contributor_contribution_period",
+    "review_participants",
+    "review_responses_interval",
+    "project_pulls",
+    "project_contributors",
+]
+TIMEOUT = 600
 TOKENS = {}
 tokens = Queue()
+loaded = {}
+pinned = set()
 for token in TOKENS:
     tokens.put(token)
 
@@ -42,9 +64,6 @@ def raw_data(self):
     return self._rawData
 
 
-GithubObject.GithubObject.data = raw_data
-
-
 def initialize(directory=None):
     if not (version_info[0:2] == (3, 9) and maxsize > 2**32):
         raise RuntimeError("Python 3.9 (64-bit) is required")
@@ -56,51 +75,54 @@ def initialize(directory=None):
     chdir(directory)
 
 
-def logger(name, level="INFO", modules=None):
+def logger(name, level="INFO", modules=None, pin=False):
     name = Path(name).stem
-    dictConfig(
-        {
-            "version": 1,
-            "formatters": {
-                "file": {
-                    "format": "{asctime}\t{levelname}\t{name}\t{message}",
-                    "datefmt": "%Y-%m-%d %H:%M:%S",
-                    "style": "{",
-                },
-                "stream": {
-                    "()": "colorlog.ColoredFormatter",
-                    "format": "{blue}{asctime}\t{name}\t{message_log_color}{message}",
-                    "datefmt": "%Y-%m-%d %H:%M:%S",
-                    "style": "{",
-                    "secondary_log_colors": {
-                        "message": {
-                            "DEBUG": "cyan",
-                            "INFO": "green",
-                            "WARNING": "yellow",
-                            "ERROR": "red",
-                            "CRITICAL": "bold_red",
-                        }
+    if not pinned:
+        if pin:
+            pinned.add(name)
+        dictConfig(
+            {
+                "version": 1,
+                "formatters": {
+                    "file": {
+                        "format": "{asctime}\t{levelname}\t{name}\t{message}",
+                        "datefmt": "%Y-%m-%d %H:%M:%S",
+                        "style": "{",
+                    },
+                    "stream": {
+                        "()": "colorlog.ColoredFormatter",
+                        "format": "{blue}{asctime}\t{name}\t{message_log_color}{message}",
+                        "datefmt": "%Y-%m-%d %H:%M:%S",
+                        "style": "{",
+                        "secondary_log_colors": {
+                            "message": {
+                                "DEBUG": "cyan",
+                                "INFO": "green",
+                                "WARNING": "yellow",
+                                "ERROR": "red",
+                                "CRITICAL": "bold_red",
+                            }
+                        },
                     },
                 },
-            },
-            "handlers": {
-                "file": {
-                    "class": "logging.FileHandler",
-                    "formatter": "file",
-                    "filename": f"{name}.log",
+                "handlers": {
+                    "file": {
+                        "class": "logging.FileHandler",
+                        "formatter": "file",
+                        "filename": f"{name}.log",
+                    },
+                    "stream": {
+                        "class": "colorlog.StreamHandler",
+                        "formatter": "stream",
+                    },
                 },
-                "stream": {
-                    "class": "colorlog.StreamHandler",
-                    "formatter": "stream",
+                "root": {
+                    "level": level,
+                    "handlers": ["file", "stream"],
                 },
-            },
-            "root": {
-                "level": level,
-                "handlers": ["file", "stream"],
-            },
-            "disable_existing_loggers": False,
-        }
-    )
+                "disable_existing_loggers": False,
+            }
+        )
     if modules is not None:
         for module, level in modules.items():
             getLogger(module).setLevel(level)
@@ -108,6 +130,10 @@ def logger(name, level="INFO", modules=None):
 
 
 def github(token=None, done=False):
+    from github import BadCredentialsException, Github, GithubObject, RateLimitExceededException
+    from urllib3.util.retry import Retry
+
+    GithubObject.GithubObject.data = raw_data
     if token is not None:
         tokens.put(token)
     if not done:
@@ -137,14 +163,128 @@ def github(token=None, done=False):
         return token, client
 
 
-def persist(file):
+def prune(data):
+    if isinstance(data, list):
+        return [prune(value) for value in data]
+    if isinstance(data, dict):
+        if "login" in data and "avatar_url" in data:
+            return {"login": data["login"], "type": data.get("type")}
+        return {
+            key: prune(value)
+            for key, value in data.items()
+            if key not in PRUNED and not (key.endswith("_url") and key not in ["html_url", "commit_url"])
+        }
+    return data
+
+
+def codec(file, compress=False, pruned=False):
+    from sqlitedict import SqliteDict
+    from zstandard import ZstdCompressionDict, ZstdCompressor, ZstdDecompressor, ZstdError, train_dictionary
+
+    state = {"samples": []}
+
+    def dictionary():
+        return SqliteDict(file, tablename="dictionary", autocommit=True, encode=bytes, decode=bytes)
+
+    def compressor():
+        if "compressor" not in state:
+            with dictionary() as dictionaries:
+                state["compressor"] = (
+                    ZstdCompressor(dict_data=ZstdCompressionDict(dictionaries["zstd"]))
+                    if "zstd" in dictionaries
+                    else None
+                )
+        return state["compressor"]
+
+    def decompressor():
+        if "decompressor" not in state:
+            with dictionary() as dictionaries:
+                state["decompressor"] = ZstdDecompressor(dict_data=ZstdCompressionDict(dictionaries["zstd"]))
+        return state["decompressor"]
+
+    def train():
+        try:
+            trained = train_dictionary(DICTIONARY, state["samples"])
+        except ZstdError as exception:
+            log.warning(f"{file}: Failed training compression dictionary due to {exception}")
+            state["compressor"] = False
+        else:
+            with dictionary() as dictionaries:
+                dictionaries.conn.execute(
+                    f'INSERT OR IGNORE INTO "{dictionaries.tablename}" (key, value) VALUES (?, ?)',
+                    ("zstd", trained.as_bytes()),
+                )
+                dictionaries.commit()
+                state["compressor"] = ZstdCompressor(dict_data=ZstdCompressionDict(dictionaries["zstd"]))
+        state["samples"] = []
+
     def encode(data):
-        return dumps(data, ensure_ascii=False, separators=(",", ":"))
+        if pruned:
+            data = prune(data)
+        data = dumps(data, ensure_ascii=False, separators=(",", ":"))
+        if compress and (current := compressor()) is not False:
+            if current is not None:
+                return current.compress(data.encode())
+            state["samples"].append(data.encode())
+            if len(state["samples"]) >= SAMPLES:
+                train()
+        return data
 
     def decode(data):
+        if isinstance(data, bytes):
+            data = decompressor().decompress(data)
         return loads(data)
 
-    return SqliteDict(file, tablename="data", autocommit=True, encode=encode, decode=decode)
+    return encode, decode
+
+
+def persist(file, compress=False, pruned=False):
+    from sqlitedict import SqliteDict
+
+    encode, decode = codec(file, compress, pruned)
+    return SqliteDict(file, tablename="data", autocommit=True, encode=encode, decode=decode, timeout=TIMEOUT)
+
+
+def compact(file, pruned=False):
+    with persist(file, compress=True, pruned=pruned) as database:
+        rows = [
+            (key, loads(value))
+            for key, value in database.conn.select("SELECT key, value FROM data")
+            if isinstance(value, str)
+        ]
+        for key, value in rows:
+            database[key] = value
+
+
+def extract(file, fields, each=False):
+    from sqlitedict import SqliteDict
+
+    decode = codec(file)[1]
+    source = "item" if each else "data"
+    columns = ", ".join([f"json_extract({source}.value, ?)" for _ in fields])
+    parameters = [f"$.{field}" for field in fields]
+    with SqliteDict(file, tablename="data", flag="r") as database:
+        if each:
+            rows = database.conn.select(
+                f"SELECT data.key, item.key, {columns} FROM data"
+                " LEFT JOIN json_each(CASE WHEN typeof(data.value) = 'text' THEN data.value ELSE '[]' END) AS item"
+                " WHERE typeof(data.value) = 'text' ORDER BY data.rowid",
+                parameters,
+            )
+            for key, items in groupby(rows, lambda row: row[0]):
+                yield key, [dict(zip(fields, item[2:])) for item in items if item[1] is not None]
+        else:
+            for key, *values in database.conn.select(
+                f"SELECT key, {columns} FROM data WHERE typeof(value) = 'text' ORDER BY rowid", parameters
+            ):
+                yield key, dict(zip(fields, values))
+        for key, value in database.conn.select("SELECT key, value FROM data WHERE typeof(value) = 'blob'"):
+            value = decode(value)
+            if each:
+                items = value.values() if isinstance(value, dict) else value
+                yield key, [{field: lookup(field, item) for field in fields} for item in items]
+            else:
+                yield key, {field: lookup(field, value) for field in fields}
 
 
 def lookup(attributes, json):
@@ -176,18 +316,38 @@ def paths(file, project=None):
         "commits": directory + f"{project}_commits.db",
         "files": directory + f"{project}_files.db",
         "metadata": directory + f"{project}.db",
+        "jobs": "jobs.db",
+        "telemetry": "telemetry/",
+        # Generated in process_data.py and later stages
+        "strings": "strings.db",
+        # Generated in pipeline.py
+        "pipeline": "pipeline.csv",
+        # Generated in benchmark_storage.py
+        "storage": "storage.csv",
         # Generated in preprocess_data.py
         "timelines_fixed": directory + f"{project}_timelines_fixed.db",
         "timelines_preprocessed": directory + f"{project}_timelines.csv",
         "pulls_preprocessed": directory + f"{project}_pulls.csv",
+        "changes": directory + f"{project}_changes.csv",
+        # Generated in clean_comments.py
+        "comments": directory + f"{project}_comments.csv",
+        "comment_fingerprints": directory + f"{project}_comment_fingerprints.csv",
         # Generated in process_data.py
         "dataframe": directory + f"{project}_dataframe.csv",
+        "dataframe_pulls": directory + f"{project}_dataframe_pulls.csv",
+        "fingerprints": directory + f"{project}_fingerprints.csv",
         # Generated in postprocess_data.py
         "statistics": "statistics.csv",
         "dataset": directory + f"{project}_dataset.csv",
+        "dataset_pulls": directory + f"{project}_dataset_pulls.csv",
         "sample": directory + f"{project}_sample.csv",
+        "associations": directory + f"{project}_associations.csv",
         # Generated in analyze_inactivity.py
+        "lifetimes": directory + f"{project}_lifetimes.csv",
         "inactivity": "inactivity.csv",
+        "inactivity_projects": "inactivity_projects.csv",
+        # Generated in sweep_sensitivity.py
+        "sensitivity": "sensitivity.csv",
         # Generated in prelabel_data.py
         "prelabeling": "prelabeling.csv",
         # Generated in label_data.py
@@ -203,23 +363,193 @@ def paths(file, project=None):
         # Generated in analyze_survey.py
         "survey": "survey.xlsx",
         # Generated in measure_features.py
+        "state": directory + f"{project}_state.csv",
         "features": directory + f"{project}_features.csv",
+        "matrix": directory + f"{project}_matrix.npy",
+        "targets": directory + f"{project}_targets.npy",
+        "schema": directory + f"{project}_schema.json",
+        # Generated in extract_text.py
+        "text": directory + f"{project}_text.npz",
+        # Generated in evaluate_snapshots.py
+        "snapshots": directory + f"{project}_snapshots.csv",
+        "evolution": "evolution.csv",
         # Generated in build_deeplearning.py
+        "model": directory + f"{project}_model.joblib",
         "deeplearning": "deeplearning.csv",
+        # Generated in build_randomforest.py
+        "forest": directory + f"{project}_forest.joblib",
+        "forest_matrix": directory + f"{project}_forest_matrix.npy",
+        "forest_targets": directory + f"{project}_forest_targets.npy",
+        "forest_performance": "forest_performance.csv",
+        "forest_importance": "forest_importance.csv",
     }
     return Path(files[file])
 
 
-def refresh():
+def arguments():
     parser = ArgumentParser()
     parser.add_argument("-y", action="store_true", help="force fresh start")
     parser.add_argument("-n", action="store_true", help="do not force fresh start")
-    if (parser := parser.parse_args()).y:
+    parser.add_argument("-i", action="store_true", help="only process new or changed pull requests")
+    parser.add_argument("-s", action="store_true", help="search model configurations before evaluation")
+    parser.add_argument("-c", action="store_true", help="coordinate collection through the job queue")
+    parser.add_argument("-w", action="store_true", help="work on collection jobs from the job queue")
+    return parser.parse_args()
+
+
+def refresh():
+    if (parser := arguments()).y:
         return True
     elif parser.n:
         return False
 
 
+def incremental():
+    return arguments().i
+
+
+def search():
+    return arguments().s
+
+
+def coordinate():
+    return arguments().c
+
+
+def work():
+    return arguments().w
+
+
+def dictionary():
+    connection = connect(paths("strings"), timeout=TIMEOUT, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS strings"
+        " (kind TEXT, id INTEGER, value TEXT, PRIMARY KEY (kind, id), UNIQUE (kind, value))"
+    )
+    return connection
+
+
+def strings(kind):
+    with closing(dictionary()) as connection:
+        (count,) = connection.execute("SELECT COUNT(*) FROM strings WHERE kind = ?", [kind]).fetchone()
+        if len(values := loaded.get(kind, [])) < count:
+            loaded[kind] = values = values + [
+                value
+                for value, in connection.execute(
+                    "SELECT value FROM strings WHERE kind = ? AND id >= ? ORDER BY id", [kind, len(values)]
+                )
+            ]
+    return values
+
+
+def intern(kind, values):
+    values = Series(values, dtype="object")
+    with closing(dictionary()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        known = strings(kind)
+        existing = set(known)
+        new = [value for value in values.dropna().unique() if value not in existing]
+        connection.executemany(
+            "INSERT INTO strings (kind, id, value) VALUES (?, ?, ?)",
+            [(kind, len(known) + number, value) for number, value in enumerate(new)],
+        )
+        connection.execute("COMMIT")
+    loaded[kind] = known = known + new
+    return Series(Categorical(values, categories=known), index=values.index, name=values.name)
+
+
+def categorize(dataframe):
+    return dataframe.assign(
+        **{
+            column: Categorical.from_codes(dataframe[column], categories=strings(column))
+            for column in STRINGS
+            if column in dataframe and dataframe[column].dtype != "category"
+        }
+    )
+
+
+def identify(dataframe):
+    return dataframe.assign(
+        **{
+            column: dataframe[column].cat.codes
+            for column in STRINGS
+            if column in dataframe and dataframe[column].dtype == "category"
+        }
+    )
+
+
+def epoch(times):
+    times = Series(times, dtype=object)
+    valid = times.notna().to_numpy()
+    text = times[valid].to_numpy(dtype="S25")
+    codes = text.view("uint8").reshape(-1, 25).astype("int64")
+    digits = codes - ord("0")
+    offsets = ((digits[:, 20] * 10 + digits[:, 21]) * 60 + digits[:, 23] * 10 + digits[:, 24]) * 60
+    signs = select([codes[:, 19] == ord("+"), codes[:, 19] == ord("-")], [1, -1], 0)
+    seconds = zeros(len(times), dtype="int64")
+    seconds[valid] = text.astype("S19").astype("datetime64[s]").astype("int64") - signs * offsets
+    return Series(seconds, index=times.index, name=times.name, dtype="Int64").where(valid)
+
+
+def timestamps(dataframe):
+    return dataframe.assign(
+        **{
+            column: to_datetime(dataframe[column], unit="s")
+            for column in TIMES
+            if column in dataframe and dataframe[column].dtype.kind != "M"
+        }
+    )
+
+
+def epochs(dataframe):
+    return dataframe.assign(
+        **{
+            column: ((dataframe[column] - Timestamp(0)) // Timedelta(1, "s")).astype("Int64")
+            for column in TIMES
+            if column in dataframe and dataframe[column].dtype.kind == "M"
+        }
+    )
+
+
+def fingerprint(dataframe):
+    return (hash_pandas_object(dataframe).groupby("pull_number").sum() % 2**63).astype("int64").rename("fingerprint")
+
+
+def pack_keywords(flags):
+    return (
+        (flags[KEYWORDS].astype("uint32") << arange(len(KEYWORDS), dtype="uint32"))
+        .sum(axis="columns")
+        .astype("uint32")
+        .rename("keywords")
+    )
+
+
+def mask_keywords(keywords=None):
+    if keywords is None:
+        keywords = KEYWORDS
+    elif not isinstance(keywords, list):
+        keywords = [keywords]
+    return sum(1 << KEYWORDS.index(keyword) for keyword in keywords)
+
+
+def match_keywords(keywords, selection=None, every=False):
+    mask = mask_keywords(selection)
+    return keywords & mask == mask if every else keywords & mask != 0
+
+
+def count_keywords(keywords):
+    return unpack_keywords(keywords).sum().astype("uint32")
+
+
+def unpack_keywords(keywords):
+    return DataFrame(
+        (keywords.to_numpy("uint32")[:, None] >> arange(len(KEYWORDS), dtype="uint32")) & 1 == 1,
+        index=keywords.index,
+        columns=KEYWORDS,
+    )
+
+
 def cleanup(files, fresh=None, project=None):
     if not isinstance(files, list):
         files = [files]
@@ -235,9 +565,80 @@ def cleanup(files, fresh=None, project=None):
     if fresh:
         for file in files:
             file.unlink(missing_ok=True)
+            rmtree(file.with_name(f"{file.name}.parts"), ignore_errors=True)
     return True if fresh or not exists else False
 
 
+def import_matrix(project):
+    return (
+        load(paths("matrix", project), mmap_mode="r"),
+        load(paths("targets", project), mmap_mode="r"),
+        loads(paths("schema", project).read_text()),
+    )
+
+
+def chunk(items, size=CHUNK):
+    return [items[index : index + size] for index in range(0, len(items), size)]
+
+
+def partition(file, project=None):
+    file = paths(file, project)
+    return file.with_name(f"{file.name}.parts")
+
+
+def store(file, data, **arguments):
+    temporary = file.with_name(f"{file.name}.tmp")
+    data.to_csv(temporary, **arguments)
+    replace(temporary, file)
+
+
+def complete(parts, function, chunk, index=True):
+    results = function(chunk)
+    for part, result in zip(parts, results if isinstance(results, tuple) else (results,)):
+        store(part, result, index=index)
+
+
+def merge(file, project=None):
+    parts = sorted((directory := partition(file, project)).glob("*.csv"), key=lambda part: int(part.stem))
+    temporary = (file := paths(file, project)).with_name(f"{file.name}.tmp")
+    with open(temporary, "w") as output:
+        for number, part in enumerate(parts):
+            with open(part) as data:
+                if number:
+                    next(data)
+                copyfileobj(data, output)
+    replace(temporary, file)
+    rmtree(directory)
+
+
+def resume(files, project, function, chunks, load=None, parallel=None, index=True):
+    if not isinstance(files, list):
+        files = [files]
+    if not chunks:
+        chunks = [chunks]
+    directories = [partition(file, project) for file in files]
+    for directory in directories:
+        directory.mkdir(parents=True, exist_ok=True)
+    pending = [
+        ([directory / f"{number}.csv" for directory in directories], chunk)
+        for number, chunk in enumerate(chunks)
+        if not all((directory / f"{number}.csv").exists() for directory in directories)
+    ]
+    if len(pending) < len(chunks):
+        log.info(f"{project}: Resuming after {len(chunks) - len(pending)} of {len(chunks)} finished chunks")
+    tasks = (
+        delayed(complete)(parts, function, load(chunk) if load is not None else chunk, index)
+        for parts, chunk in pending
+    )
+    if parallel is None:
+        for task, arguments, keywords in tasks:
+            task(*arguments, **keywords)
+    else:
+        parallel(tasks)
+    for file in files:
+        merge(file, project)
+
+
 def exist(files, project, exclude=None):
     if not isinstance(files, list):
         files = [files]
@@ -256,6 +657,18 @@ def tocollect():
     return read_csv(projects, usecols=["project"]).squeeze("columns").dropna()
 
 
+def estimates():
+    if not (projects := paths("projects")).exists():
+        return {}
+    return (
+        read_csv(projects, usecols=["project", "pulls"])
+        .dropna()
+        .astype({"pulls": "int64"})
+        .set_index("project")["pulls"]
+        .to_dict()
+    )
+
+
 def collected():
     return [
         project
@@ -268,17 +681,23 @@ def preprocessed():
     return [
         project
         for project in collected()
-        if exist(["timelines_fixed", "timelines_preprocessed", "pulls_preprocessed"], project)
+        if exist(["timelines_fixed", "timelines_preprocessed", "pulls_preprocessed", "changes"], project)
     ]
 
 
+def cleaned():
+    return [project for project in preprocessed() if exist("comments", project)]
+
+
 def processed():
-    return [project for project in preprocessed() if exist("dataframe", project)]
+    return [project for project in cleaned() if exist(["dataframe", "dataframe_pulls", "fingerprints"], project)]
 
 
 def postprocessed():
-    return [project for project in processed() if exist(["dataset", "sample"], project)]
+    return [
+        project for project in processed() if exist(["dataset", "dataset_pulls", "sample", "associations"], project)
+    ]
 
 
 def measured():
-    return [project for project in postprocessed() if exist("features", project)]
+    return [project for project in postprocessed() if exist(["features", "matrix", "targets", "schema"], project)]
@@ -0,0 +1,214 @@
+from joblib import Parallel, delayed
+from numpy import (
+    arange,
+    concatenate,
+    iinfo,
+    isnat,
+    maximum,
+    minimum,
+    searchsorted,
+    sort,
+    tile,
+    timedelta64,
+    where,
+)
+from pandas import DataFrame, DateOffset, Timestamp, concat, date_range, read_csv
+
+from clean_comments import import_comments
+from common import (
+    DATE,
+    KEYWORDS,
+    cleanup,
+    initialize,
+    logger,
+    match_keywords,
+    paths,
+    persist,
+    postprocessed,
+    refresh,
+    store,
+)
+from measure_features import import_changes, import_dataset, import_dataset_pulls, import_pulls
+from postprocess_data import INACTIVITY
+from state import count_state, index_state, select_state, snapshot
+
+initialize()
+SNAPSHOTS = date_range(end=DATE, periods=7, freq=DateOffset(months=6))
+RESPONSES = ["commented", "reviewed", "line-commented", "commit-commented"]
+DAY = 86400
+NEVER = iinfo("int64").max
+
+
+def import_snapshots(project):
+    return read_csv(
+        paths("snapshots", project), usecols=["snapshot", "project", "open", "closed", "merged", "abandoned"]
+    )
+
+
+def seconds(times):
+    times = times.to_numpy("datetime64[s]")
+    return where(isnat(times), NEVER, times.astype("int64"))
+
+
+def index_events(pulls, events):
+    positions = pulls.index.get_indexer(events.index.get_level_values("pull_number")).astype("int64")
+    keys = concatenate([[-1], sort((positions << 32) | seconds(events["time"]))])
+    return keys, searchsorted(keys, arange(len(pulls), dtype="int64") << 32)
+
+
+def search_events(index, snapshots):
+    keys, starts = index
+    ends = searchsorted(keys, (arange(len(starts), dtype="int64")[:, None] << 32) | snapshots, side="right")
+    return ends - starts[:, None], where(ends > starts[:, None], keys[ends - 1] & 0xFFFFFFFF, NEVER)
+
+
+def first_events(index):
+    keys, starts = index
+    ends = concatenate([starts[1:], [len(keys)]])
+    return where(starts < ends, keys[minimum(starts, len(keys) - 1)] & 0xFFFFFFFF, NEVER)
+
+
+def find_keywords(pulls, dataset, comments, snapshots):
+    remarks = dataset.loc[~dataset["contributor"] & (dataset["event"] == "commented"), ["time"]].join(
+        comments, how="inner"
+    )
+    keywords = 0
+    for bit, keyword in enumerate(KEYWORDS):
+        hits = remarks[remarks["body"].str.contains(keyword, regex=False)]
+        counts, _ = search_events(index_events(pulls, hits), snapshots)
+        keywords = keywords | ((counts > 0).astype("uint32") << bit)
+    return keywords
+
+
+def expand(values, count):
+    return values.T.ravel() if values.ndim == 2 else tile(values, count)
+
+
+def evaluate_snapshots(project):
+    log = logger(__file__, modules={"sqlitedict": "WARNING"})
+    log.info(f"{project}: Evaluating {len(SNAPSHOTS)} snapshots")
+    dataset = import_dataset(project)
+    pulls = import_dataset_pulls(project).sort_index()
+    descriptions = import_pulls(project)
+    changes = import_changes(project)
+    metadata = persist(paths("metadata", project))
+    created_at = Timestamp(metadata["created_at"]).tz_convert(tz=None)
+    snapshots = seconds(SNAPSHOTS)
+    opened = seconds(pulls["opened_at"])[:, None]
+    merged_at = seconds(pulls["merged_at"])[:, None]
+    closed_at = seconds(pulls["closed_at"])[:, None]
+    undated = (pulls["closed"] & pulls["closed_at"].isna()).to_numpy()[:, None]
+    merged = merged_at <= snapshots
+    closed = ~merged & ((closed_at <= snapshots) | undated)
+    lifetime = where(merged, merged_at, where(closed & ~undated, closed_at, snapshots)) - opened
+    _, active = search_events(
+        index_events(pulls, dataset.query("contributor and event not in ['mentioned', 'subscribed']")), snapshots
+    )
+    inactive_days = (snapshots - active) // DAY
+    keywords = find_keywords(pulls, dataset, import_comments(project), snapshots)
+    abandoned = ~merged & (inactive_days >= INACTIVITY) & match_keywords(keywords)
+    responses = dataset.join(pulls["opened_at"], on="pull_number").query("event in @RESPONSES and time > opened_at")
+    participant_responses = responses.query("not contributor")
+    index = index_events(pulls, participant_responses)
+    participant_counts, last_responses = search_events(index, snapshots)
+    first_responses = first_events(index)[:, None]
+    participants, _ = search_events(
+        index_events(pulls, participant_responses.groupby(["pull_number", "actor"], observed=True)[["time"]].min()),
+        snapshots,
+    )
+    contributor_counts, _ = search_events(index_events(pulls, responses.query("contributor")), snapshots)
+    commits, _ = search_events(index_events(pulls, dataset.query("event == 'committed'")), snapshots)
+    state = index_state(count_state(select_state(pulls)))
+    histories = DataFrame(
+        [
+            snapshot(state, actor, opened_at, state["pulls"][pull_number])
+            for pull_number, actor, opened_at in zip(pulls.index, pulls["actor"], pulls["opened_at"])
+        ]
+    )
+    previous = DataFrame(abandoned).groupby(pulls["actor"].to_numpy()).cumsum().to_numpy() - abandoned
+    contributor_pulls = histories["contributor_pulls"].to_numpy()[:, None]
+    columns = {
+        # Identifiers
+        "snapshot": tile(SNAPSHOTS.to_numpy(), (len(pulls), 1)),
+        "project": project,
+        "pull_number": pulls.index.to_numpy(),
+        "open": ~merged & ~closed,
+        "closed": closed,
+        "merged": merged,
+        "abandoned": abandoned,
+        "inactive_days": inactive_days,
+        "keywords": keywords,
+        # PR Features
+        "pr_description": (descriptions["title"] + " " + descriptions["body"])
+        .str.split()
+        .str.len()
+        .reindex(pulls.index)
+        .to_numpy(),
+        "pr_commits": commits,
+        "pr_changed_lines": changes["changed_lines"].reindex(pulls.index).to_numpy(),
+        "pr_changed_files": changes["changed_files"].reindex(pulls.index).to_numpy(),
+        "pr_lifetime": lifetime // DAY,
+        # Contributor Features
+        "contributor_pulls": histories["contributor_pulls"].to_numpy(),
+        "contributor_contribution_period": histories["contributor_contribution_period"].to_numpy(),
+        "contributor_acceptance_rate": histories["contributor_acceptance_rate"].to_numpy(),
+        "contributor_abandonment_rate": where(contributor_pulls > 0, previous / maximum(contributor_pulls, 1), 0),
+        # Review Process Features
+        "review_participants": participants,
+        "review_participant_responses": participant_counts,
+        "review_contributor_responses": contributor_counts,
+        "review_response_latency": where(participant_counts > 0, first_responses - opened, lifetime) // DAY,
+        "review_responses_interval": (
+            where(participant_counts > 0, (last_responses - opened) // maximum(participant_counts, 1), lifetime) // DAY
+        ),
+        # Project Features
+        "project_age": ((pulls["opened_at"] - created_at) // timedelta64(1, "M")).to_numpy(),
+        "project_pulls": histories["project_pulls"].to_numpy(),
+        "project_contributors": histories["project_contributors"].to_numpy(),
+        "project_unresolved_pulls": histories["project_unresolved_pulls"].to_numpy(),
+    }
+    eligible = expand(opened < snapshots - INACTIVITY * DAY, len(SNAPSHOTS))
+    table = DataFrame(
+        {
+            column: values if isinstance(values, str) else expand(values, len(SNAPSHOTS))
+            for column, values in columns.items()
+        }
+    )
+    store(paths("snapshots", project), table[eligible], index=False)
+
+
+def summarize_snapshots(projects):
+    log = logger(__file__)
+    log.info("Summarizing snapshots")
+    snapshots = concat([import_snapshots(project) for project in projects])
+    evolution = snapshots.groupby(["project", "snapshot"]).agg(
+        pulls=("open", "size"),
+        open=("open", "sum"),
+        closed=("closed", "sum"),
+        merged=("merged", "sum"),
+        abandoned=("abandoned", "sum"),
+    )
+    evolution["abandonment_rate"] = evolution["abandoned"] / evolution["pulls"]
+    store(paths("evolution"), evolution.reset_index(), index=False)
+
+
+def main():
+    fresh = refresh()
+    projects = []
+    for project in postprocessed():
+        if cleanup("snapshots", fresh, project):
+            projects.append(project)
+        else:
+            print(f"Skip evaluating snapshots for project {project}")
+    with Parallel(n_jobs=-1) as parallel:
+        parallel(delayed(evaluate_snapshots)(project) for project in projects)
+    if evaluated := [project for project in postprocessed() if paths("snapshots", project).exists()]:
+        summarize_snapshots(evaluated)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Stop evaluating snapshots")
+        exit(1)
@@ -2,16 +2,17 @@ from csv import QUOTE_ALL
 
 from pandas import DataFrame, concat, read_csv
 
-from common import cleanup, initialize, logger, paths, preprocessed, refresh
+from common import cleanup, identify, initialize, intern, logger, paths, preprocessed, refresh, strings
 
 initialize()
 log = logger(__file__)
 
 
 def import_timelines(project):
-    return read_csv(
+    timelines = read_csv(
         paths("timelines_preprocessed", project), usecols=["actor", "author.name", "author.email"], quoting=QUOTE_ALL
     ).dropna()
+    return identify(timelines.assign(actor=intern("actor", timelines["actor"])))
 
 
 def export_developers(developers):
@@ -23,7 +24,7 @@ def export_developers(developers):
 def extract_developers():
     log.info("Extracting developers")
     events = concat([import_timelines(project) for project in preprocessed()]).astype(
-        {"actor": "category", "author.name": "category", "author.email": "category"}
+        {"author.name": "category", "author.email": "category"}
     )
     events = events.drop(
         events.query(
@@ -32,9 +33,11 @@ def extract_developers():
         ).index
     )
     developers = {}
-    for actor in [actor for actor in events["actor"].unique() if actor != "ghost"]:
+    actors = strings("actor")
+    ghost = intern("actor", ["ghost"]).cat.codes.iat[0]
+    for actor in [actor for actor in events["actor"].unique() if actor != ghost]:
         actor_events = events.query("actor == @actor")
-        developers[actor] = {
+        developers[actors[actor]] = {
             "name": ", ".join(sorted(actor_events["author.name"].unique())),
             "email": ", ".join(sorted(actor_events["author.email"].unique())),
         }
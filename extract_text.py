@@ -0,0 +1,120 @@
+from csv import QUOTE_ALL
+from json import loads
+from os import replace
+from re import escape
+
+from joblib import Parallel, delayed
+from pandas import Index, read_csv
+
+from common import KEYWORDS, cleanup, initialize, logger, measured, paths, refresh
+
+initialize()
+FEATURES = 2**18
+ROWS = 100_000
+
+
+def import_schema(project):
+    return loads(paths("schema", project).read_text())
+
+
+def import_pulls(project):
+    return read_csv(
+        paths("pulls_preprocessed", project),
+        usecols=["number", "title", "body"],
+        dtype={"title": "string", "body": "string"},
+        quoting=QUOTE_ALL,
+        chunksize=ROWS,
+    )
+
+
+def import_comments(project):
+    return read_csv(
+        paths("comments", project),
+        usecols=["pull_number", "body"],
+        dtype={"body": "string"},
+        keep_default_na=False,
+        chunksize=ROWS,
+    )
+
+
+def import_remarks(project):
+    keywords = "|".join(escape(keyword) for keyword in KEYWORDS)
+    for comments in import_comments(project):
+        yield comments[~comments["body"].str.contains(keywords, regex=True)]
+
+
+def hash_texts(pull_numbers, numbers, texts):
+    from scipy.sparse import csr_matrix
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    rows = pull_numbers.get_indexer(numbers)
+    selected = rows >= 0
+    vectorizer = HashingVectorizer(
+        n_features=FEATURES, ngram_range=(1, 2), alternate_sign=False, norm=None, dtype="float32"
+    )
+    counts = vectorizer.transform(texts[selected].fillna("")).tocoo()
+    return csr_matrix(
+        (counts.data, (rows[selected][counts.row], counts.col)), shape=(len(pull_numbers), FEATURES), dtype="float32"
+    )
+
+
+def extract_descriptions(project, pull_numbers, parallel):
+    return parallel(
+        delayed(hash_texts)(
+            pull_numbers, pulls["number"].to_numpy(), pulls["title"].fillna("") + " " + pulls["body"].fillna("")
+        )
+        for pulls in import_pulls(project)
+    )
+
+
+def extract_comments(project, pull_numbers, parallel):
+    return parallel(
+        delayed(hash_texts)(pull_numbers, remarks["pull_number"].to_numpy(), remarks["body"])
+        for remarks in import_remarks(project)
+    )
+
+
+def export_text(project, text):
+    from scipy.sparse import save_npz
+
+    temporary = (file := paths("text", project)).with_name(f"{file.name}.tmp")
+    with open(temporary, "wb") as output:
+        save_npz(output, text)
+    replace(temporary, file)
+
+
+def extract_text(project):
+    from scipy.sparse import csr_matrix, hstack
+    from sklearn.preprocessing import normalize
+
+    log = logger(__file__)
+    log.info(f"{project}: Extracting text features")
+    pull_numbers = Index(import_schema(project)["pull_numbers"])
+    with Parallel(n_jobs=-1) as parallel:
+        blocks = [
+            sum(parts, csr_matrix((len(pull_numbers), FEATURES), dtype="float32"))
+            for parts in [
+                extract_descriptions(project, pull_numbers, parallel),
+                extract_comments(project, pull_numbers, parallel),
+            ]
+        ]
+    export_text(project, hstack([normalize(block) for block in blocks], format="csr", dtype="float32"))
+
+
+def main():
+    projects = []
+    for project in measured():
+        if cleanup("text", refresh(), project):
+            projects.append(project)
+        else:
+            print(f"Skip extracting text features for project {project}")
+    for project in projects:
+        extract_text(project)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Stop extracting text features")
+        exit(1)
@@ -1,4 +1,8 @@
-from github import BadCredentialsException, RateLimitExceededException, UnknownObjectException
+from itertools import chain
+from json import dumps
+from math import ceil
+
+from github import BadCredentialsException, GithubException, RateLimitExceededException
 from joblib import Parallel, delayed
 from pandas import DataFrame
 
@@ -6,50 +10,86 @@ from common import TOKENS, cleanup, github, initialize, logger, paths, refresh
 
 initialize()
 log = logger(__file__, modules={"urllib3": "ERROR"})
+STARS = 15000
+RESULTS = 1000
+BATCH = 50
 
 
-def fetch_projects():
+def request(message, function):
     token, client = github()
     while True:
         try:
-            log.info("Fetching list of projects")
-            projects = [
-                project.full_name.lower() for project in client.search_repositories("stars:>15000", sort="stars")
-            ]
+            log.info(message)
+            result = function(client)
         except (BadCredentialsException, RateLimitExceededException):
             token, client = github(token)
         except Exception as exception:
-            log.error(f"Failed fetching list of projects due to {exception}")
+            log.error(f"{message} failed due to {exception}")
         else:
             break
     github(token, done=True)
-    return projects
+    return result
 
 
-def fetch_metadata(project):
-    metadata = {"project": project, "pulls": None, "stars": None}
-    token, client = github()
-    while True:
+def search(client, query):
+    return client.search_repositories(query, sort="stars")
+
+
+def split_stars(low, high):
+    query = f"stars:{low}..{high}"
+    count = request(f"Counting projects for {query}", lambda client: search(client, query).totalCount)
+    if count <= RESULTS or low == high:
+        if count > RESULTS:
+            log.warning(f"Search for {query} is capped at {RESULTS} of {count} projects")
+        return [(query, min(count, RESULTS))]
+    middle = (low + high) // 2
+    return split_stars(middle + 1, high) + split_stars(low, middle)
+
+
+def fetch_page(query, page):
+    return request(
+        f"Fetching page {page} of projects for {query}",
+        lambda client: [project.full_name.lower() for project in search(client, query).get_page(page)],
+    )
+
+
+def fetch_projects(parallel):
+    highest = request(
+        "Fetching most starred project", lambda client: search(client, f"stars:>{STARS}")[0].stargazers_count
+    )
+    pages = [(query, page) for query, count in split_stars(STARS + 1, highest) for page in range(ceil(count / 100))]
+    log.info(f"Fetching list of projects from {len(pages)} pages")
+    return list(dict.fromkeys(chain.from_iterable(parallel(delayed(fetch_page)(*page) for page in pages))))
+
+
+def fetch_metadata(projects):
+    def query(client):
+        repositories = " ".join(
+            f"project{index}: repository(owner: {dumps(owner)}, name: {dumps(name)})"
+            " { nameWithOwner stargazerCount pullRequests { totalCount } }"
+            for index, (owner, name) in enumerate(project.split("/") for project in projects)
+        )
         try:
-            log.info(f"{project}: Fetching metadata")
-            repository = client.get_repo(project)
-            metadata.update(
+            return client.requester.graphql_query(f"query {{ {repositories} }}", {})[1]["data"]
+        except GithubException as exception:
+            if not isinstance(exception.data, dict) or exception.data.get("data") is None:
+                raise
+            return exception.data["data"]
+
+    data = request(f"Fetching metadata for {len(projects)} projects ({projects[0]}, ...)", query)
+    metadata = []
+    for index, project in enumerate(projects):
+        if (repository := data.get(f"project{index}")) is None:
+            log.warning(f"{project}: Project does not exist")
+            metadata.append({"project": project, "pulls": None, "stars": None})
+        else:
+            metadata.append(
                 {
-                    "project": repository.full_name.lower(),
-                    "pulls": repository.get_pulls(state="all").totalCount,
-                    "stars": repository.watchers,
+                    "project": repository["nameWithOwner"].lower(),
+                    "pulls": repository["pullRequests"]["totalCount"],
+                    "stars": repository["stargazerCount"],
                 }
             )
-        except (BadCredentialsException, RateLimitExceededException):
-            token, client = github(token)
-        except UnknownObjectException:
-            log.warning(f"{project}: Project does not exist")
-            break
-        except Exception as exception:
-            log.error(f"{project}: Failed fetching metadata due to {exception}")
-        else:
-            break
-    github(token, done=True)
     return metadata
 
 
@@ -62,7 +102,17 @@ def export_projects(metadata):
 def main():
     if cleanup("projects", refresh()):
         with Parallel(n_jobs=len(TOKENS), prefer="threads") as parallel:
-            export_projects(parallel(delayed(fetch_metadata)(project) for project in fetch_projects()))
+            projects = fetch_projects(parallel)
+            export_projects(
+                list(
+                    chain.from_iterable(
+                        parallel(
+                            delayed(fetch_metadata)(projects[index : index + BATCH])
+                            for index in range(0, len(projects), BATCH)
+                        )
+                    )
+                )
+            )
     else:
         print("Skip fetching projects")
 
@@ -0,0 +1,118 @@
+from contextlib import closing
+from os import getpid, kill
+from socket import gethostname
+from sqlite3 import connect
+from threading import get_ident
+from time import time
+
+from common import TIMEOUT, paths
+
+LEASE = 600
+
+
+def connect_jobs():
+    connection = connect(paths("jobs"), timeout=TIMEOUT, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS jobs (project TEXT, low INTEGER, high INTEGER, size INTEGER DEFAULT 0,"
+        " status TEXT DEFAULT 'pending', worker TEXT, expires REAL, PRIMARY KEY (project, low))"
+    )
+    return connection
+
+
+def identify_worker():
+    return f"{gethostname()}:{getpid()}:{get_ident()}"
+
+
+def enqueue_jobs(project, ranges, reset=False):
+    with closing(connect_jobs()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        if reset:
+            connection.execute("DELETE FROM jobs WHERE project = ?", [project])
+        connection.executemany(
+            "INSERT INTO jobs (project, low, high, size) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (project, low) DO UPDATE SET high = excluded.high, size = excluded.size, status = CASE"
+            " WHEN status = 'failed' OR (status = 'done' AND high IS NOT excluded.high) THEN 'pending' ELSE status END",
+            [(project, low, high, size) for low, high, size in ranges],
+        )
+        connection.execute("COMMIT")
+
+
+def lease_job(worker):
+    with closing(connect_jobs()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        job = connection.execute(
+            "SELECT project, low, high FROM jobs WHERE status = 'pending' OR (status = 'leased' AND expires < ?)"
+            " ORDER BY size DESC, rowid LIMIT 1",
+            [time()],
+        ).fetchone()
+        if job is not None:
+            connection.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, expires = ? WHERE project = ? AND low = ?",
+                [worker, time() + LEASE, *job[:2]],
+            )
+        connection.execute("COMMIT")
+    return job
+
+
+def running(worker):
+    host, pid, _ = worker.rsplit(":", 2)
+    if host != gethostname():
+        return True
+    try:
+        kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def release_jobs():
+    with closing(connect_jobs()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        released = [
+            (project, low, worker)
+            for project, low, worker, expires in connection.execute(
+                "SELECT project, low, worker, expires FROM jobs WHERE status = 'leased'"
+            ).fetchall()
+            if expires < time() or not running(worker)
+        ]
+        connection.executemany(
+            "UPDATE jobs SET status = 'pending', worker = NULL, expires = NULL"
+            " WHERE project = ? AND low = ? AND worker = ? AND status = 'leased'",
+            released,
+        )
+        connection.execute("COMMIT")
+
+
+def renew_job(worker, project, low, high):
+    with closing(connect_jobs()) as connection:
+        return (
+            connection.execute(
+                "UPDATE jobs SET expires = ? WHERE project = ? AND low = ? AND high IS ? AND worker = ?"
+                " AND status = 'leased'",
+                [time() + LEASE, project, low, high, worker],
+            ).rowcount
+            > 0
+        )
+
+
+def complete_job(worker, project, low, status="done"):
+    with closing(connect_jobs()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        updated = connection.execute(
+            "UPDATE jobs SET status = ?, expires = NULL WHERE project = ? AND low = ? AND worker = ?"
+            " AND status = 'leased'",
+            [status, project, low, worker],
+        ).rowcount
+        (remaining,) = connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE project = ? AND status != 'done'", [project]
+        ).fetchone()
+        connection.execute("COMMIT")
+    return updated > 0 and remaining == 0
+
+
+def remaining_jobs():
+    with closing(connect_jobs()) as connection:
+        return connection.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased')").fetchone()[0]
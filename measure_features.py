@@ -1,24 +1,50 @@
 from csv import QUOTE_ALL
+from json import dumps
+from os import replace
 
 from joblib import Parallel, delayed
-from numpy import timedelta64
+from numpy import save, timedelta64
 from pandas import DataFrame, Timestamp, concat, notna, read_csv
 
-from common import DATE, cleanup, initialize, logger, paths, persist, postprocessed, refresh
+from common import (
+    DATE,
+    categorize,
+    chunk,
+    cleanup,
+    initialize,
+    logger,
+    paths,
+    persist,
+    postprocessed,
+    refresh,
+    resume,
+    timestamps,
+)
+from state import index_state, snapshot, update_state
 
 initialize()
 
 
 def import_dataset(project):
-    return read_csv(
-        paths("dataset", project),
-        index_col=["pull_number", "event_number"],
-        dtype={"event": "category", "actor": "category"},
-        parse_dates=["time", "opened_at", "closed_at", "merged_at"],
-        infer_datetime_format=True,
+    return (
+        read_csv(
+            paths("dataset", project),
+            index_col=["pull_number", "event_number"],
+            dtype={"event": "int32", "actor": "int32"},
+        )
+        .pipe(categorize)
+        .pipe(timestamps)
     )
 
 
+def import_dataset_pulls(project):
+    return read_csv(
+        paths("dataset_pulls", project),
+        index_col="pull_number",
+        dtype={"actor": "int32"},
+    ).pipe(timestamps)
+
+
 def import_pulls(project):
     return read_csv(
         paths("pulls_preprocessed", project),
@@ -29,73 +55,52 @@ def import_pulls(project):
     ).fillna("")
 
 
-def export_features(project, features):
-    DataFrame(features).to_csv(paths("features", project), index=False)
+def import_changes(project):
+    return read_csv(
+        paths("changes", project), index_col="pull_number", usecols=["pull_number", "changed_lines", "changed_files"]
+    )
 
 
-def measure_features(project):
-    log = logger(__file__, modules={"sqlitedict": "WARNING"})
-    log.info(f"{project}: Measuring features")
-    dataset = import_dataset(project)
-    pulls = import_pulls(project)
-    files = persist(paths("files", project))
-    metadata = persist(paths("metadata", project))
+def measure_pulls(project, dataset, dataset_pulls, pulls, changes, state, created_at, pull_numbers):
     features = []
-    created_at = Timestamp(metadata["created_at"]).tz_convert(tz=None)
-    for pull_number in dataset.index.unique("pull_number"):
+    for pull_number in pull_numbers:
         timeline = dataset.query("pull_number == @pull_number")
         pulled = timeline.query("event == 'pulled'")
-        past_pulled = dataset.query("event == 'pulled' and pull_number < @pull_number")
-        contributor_pulled = past_pulled.query("actor == @pulled['actor'].iat[0]")
-        contributor_pulls = len(contributor_pulled)
+        pull = dataset_pulls.loc[pull_number]
+        opened_at = pull["opened_at"]
+        closed_at = pull["closed_at"]
+        merged_at = pull["merged_at"]
         responses = timeline.query(
-            "event in ['commented', 'reviewed', 'line-commented', 'commit-commented'] and time > opened_at"
+            "event in ['commented', 'reviewed', 'line-commented', 'commit-commented'] and time > @opened_at"
         )
         participant_responses = responses.query("not contributor")
-        changed_lines = 0
-        changed_files = 0
-        for file in files[pull_number].values():
-            changed_lines += file["changes"]
-            changed_files += 1
-        opened_at = pulled["opened_at"].iat[0]
-        closed_at = pulled["closed_at"].iat[0]
-        merged_at = pulled["merged_at"].iat[0]
         if notna(merged_at):
             lifetime = merged_at - opened_at
         elif notna(closed_at):
             lifetime = closed_at - opened_at
         else:
             lifetime = DATE - opened_at
+        history = snapshot(state, pull["actor"], opened_at, state["pulls"][pull_number])
         features.append(
             {
                 # Identifiers
                 "project": project,
                 "pull_number": pull_number,
-                "open": pulled["open"].iat[0],
-                "closed": pulled["closed"].iat[0],
-                "merged": pulled["merged"].iat[0],
-                "abandoned": pulled["abandoned"].iat[0],
+                "open": pull["open"],
+                "closed": pull["closed"],
+                "merged": pull["merged"],
+                "abandoned": pull["abandoned"],
                 # PR Features
                 "pr_description": len((pulls.loc[pull_number, "title"] + " " + pulls.loc[pull_number, "body"]).split()),
                 "pr_commits": len(timeline.query("event == 'committed'")),
-                "pr_changed_lines": changed_lines,
-                "pr_changed_files": changed_files,
+                "pr_changed_lines": changes.at[pull_number, "changed_lines"],
+                "pr_changed_files": changes.at[pull_number, "changed_files"],
                 "pr_lifetime": lifetime // timedelta64(1, "D"),
                 # Contributor Features
-                "contributor_pulls": contributor_pulls,
-                "contributor_contribution_period": (
-                    (opened_at - contributor_pulled["opened_at"].min()) // timedelta64(1, "M")
-                    if not contributor_pulled.empty
-                    else 0
-                ),
-                "contributor_acceptance_rate": (
-                    len(contributor_pulled.query("merged_at < @opened_at")) / contributor_pulls
-                    if contributor_pulls
-                    else 0
-                ),
-                "contributor_abandonment_rate": (
-                    len(contributor_pulled.query("abandoned")) / contributor_pulls if contributor_pulls else 0
-                ),
+                "contributor_pulls": history["contributor_pulls"],
+                "contributor_contribution_period": history["contributor_contribution_period"],
+                "contributor_acceptance_rate": history["contributor_acceptance_rate"],
+                "contributor_abandonment_rate": history["contributor_abandonment_rate"],
                 # Review Process Features
                 "review_participants": participant_responses["actor"].nunique(),
                 "review_participant_responses": len(participant_responses),
@@ -114,20 +119,57 @@ def measure_features(project):
                 ),
                 # Project Features
                 "project_age": (opened_at - created_at) // timedelta64(1, "M"),
-                "project_pulls": len(past_pulled),
-                "project_contributors": past_pulled["actor"].nunique(),
-                "project_unresolved_pulls": len(
-                    past_pulled.query("merged_at >= @opened_at or closed_at >= @opened_at or open")
-                ),
+                "project_pulls": history["project_pulls"],
+                "project_contributors": history["project_contributors"],
+                "project_unresolved_pulls": history["project_unresolved_pulls"],
             }
         )
-    export_features(project, features)
+    return DataFrame(features)
+
+
+def export_matrix(project):
+    features = read_csv(paths("features", project))
+    matrix = features.drop(columns=["project", "pull_number", "open", "closed", "merged", "abandoned"])
+    schema = {
+        "columns": list(matrix.columns),
+        "mean": matrix.mean().tolist(),
+        "scale": matrix.std(ddof=0).replace(0, 1).tolist(),
+        "pull_numbers": features["pull_number"].tolist(),
+    }
+    for file, array in [("matrix", matrix.to_numpy(dtype="float32")), ("targets", features["abandoned"].to_numpy())]:
+        temporary = (file := paths(file, project)).with_name(f"{file.name}.tmp")
+        with open(temporary, "wb") as output:
+            save(output, array)
+        replace(temporary, file)
+    paths("schema", project).write_text(dumps(schema))
+
+
+def measure_features(project):
+    log = logger(__file__, modules={"sqlitedict": "WARNING"})
+    log.info(f"{project}: Measuring features")
+    dataset = import_dataset(project)
+    dataset_pulls = import_dataset_pulls(project)
+    pulls = import_pulls(project)
+    changes = import_changes(project)
+    metadata = persist(paths("metadata", project))
+    created_at = Timestamp(metadata["created_at"]).tz_convert(tz=None)
+    state = index_state(update_state(project, dataset_pulls))
+    resume(
+        "features",
+        project,
+        lambda pull_numbers: measure_pulls(
+            project, dataset, dataset_pulls, pulls, changes, state, created_at, pull_numbers
+        ),
+        chunk(dataset_pulls.index),
+        index=False,
+    )
+    export_matrix(project)
 
 
 def main():
     projects = []
     for project in postprocessed():
-        if cleanup("features", refresh(), project):
+        if cleanup(["features", "matrix", "targets", "schema"], refresh(), project):
             projects.append(project)
         else:
             print(f"Skip measuring features for project {project}")
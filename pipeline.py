@@ -0,0 +1,58 @@
+from importlib import import_module
+from time import perf_counter
+
+started = perf_counter()
+STAGES = [
+    "preprocess_data",
+    "clean_comments",
+    "process_data",
+    "postprocess_data",
+    "analyze_inactivity",
+    "sweep_sensitivity",
+    "prelabel_data",
+    "label_data",
+    "calculate_agreement",
+    "extract_developers",
+    "analyze_survey",
+    "measure_features",
+    "evaluate_snapshots",
+    "build_deeplearning",
+    "build_randomforest",
+]
+
+
+def run_stage(stage, log):
+    start = perf_counter()
+    module = import_module(stage)
+    imported = perf_counter()
+    module.main()
+    finished = perf_counter()
+    log.info(f"{stage}: Imported in {imported - start:.2f}s and ran in {finished - imported:.2f}s")
+    return {"stage": stage, "import": imported - start, "run": finished - imported}
+
+
+def export_timings(timings):
+    from pandas import DataFrame
+
+    from common import paths
+
+    DataFrame(timings).to_csv(paths("pipeline"), index=False)
+
+
+def main():
+    from common import initialize, logger
+
+    initialize()
+    log = logger(__file__, pin=True)
+    timings = [{"stage": "pipeline", "import": perf_counter() - started, "run": 0.0}]
+    for stage in STAGES:
+        timings.append(run_stage(stage, log))
+        export_timings(timings)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Stop running pipeline")
+        exit(1)
@@ -1,22 +1,58 @@
 from csv import QUOTE_ALL
+from shutil import rmtree
 
 from joblib import Parallel, delayed
 from numpy import timedelta64
-from pandas import DataFrame, Timedelta, read_csv
+from pandas import DataFrame, Timedelta, concat, read_csv
 
-from common import DATE, KEYWORDS, cleanup, initialize, logger, paths, persist, processed, refresh
+from common import (
+    DATE,
+    KEYWORDS,
+    categorize,
+    cleanup,
+    count_keywords,
+    epochs,
+    exist,
+    identify,
+    incremental,
+    initialize,
+    intern,
+    logger,
+    match_keywords,
+    partition,
+    paths,
+    persist,
+    processed,
+    refresh,
+    store,
+    timestamps,
+)
 
 initialize()
 INACTIVITY = 183
 
 
 def import_dataframe(project):
-    return read_csv(
-        paths("dataframe", project),
-        index_col=["pull_number", "event_number"],
-        dtype={"event": "category", "actor": "category", "author_association": "category", "inactive_days": "uint16"},
-        parse_dates=["time", "opened_at", "closed_at", "merged_at"],
-        infer_datetime_format=True,
+    return (
+        read_csv(
+            paths("dataframe", project),
+            index_col=["pull_number", "event_number"],
+            dtype={"event": "int32", "actor": "int32", "author_association": "int32"},
+        )
+        .pipe(categorize)
+        .pipe(timestamps)
+    )
+
+
+def import_dataframe_pulls(project):
+    return (
+        read_csv(
+            paths("dataframe_pulls", project),
+            index_col="pull_number",
+            dtype={"actor": "int32", "inactive_days": "uint16", "keywords": "uint32"},
+        )
+        .pipe(categorize)
+        .pipe(timestamps)
     )
 
 
@@ -30,18 +66,63 @@ def import_pulls(project):
     )
 
 
-def fill_association(dataframe):
-    def find_association(events):
-        if not (associations := events.query("author_association.notna()")).empty:
-            events["author_association"] = associations["author_association"].mode().iat[0]
-        else:
-            events["author_association"] = "NONE"
-        return events[["author_association"]]
+def import_fingerprints(project):
+    return read_csv(paths("fingerprints", project), index_col="pull_number").squeeze("columns")
+
 
-    dataframe["author_association"] = (
-        dataframe[["actor", "author_association"]].groupby("actor", group_keys=False).apply(find_association)
+def import_associations(project):
+    return read_csv(
+        paths("associations", project),
+        dtype={"actor": "Int32", "author_association": "Int32", "count": "uint32"},
     )
-    return dataframe.astype({"author_association": "category"})
+
+
+def count_associations(dataframe, fingerprints):
+    counts = (
+        identify(dataframe)
+        .query("author_association >= 0")
+        .groupby(["pull_number", "actor", "author_association"])
+        .size()
+        .rename("count")
+        .reset_index()
+    )
+    return (
+        fingerprints.reset_index()
+        .merge(counts, on="pull_number", how="left")
+        .fillna({"count": 0})
+        .astype({"actor": "Int32", "author_association": "Int32", "count": "uint32"})
+    )
+
+
+def update_associations(project, dataframe, fingerprints):
+    associations = import_associations(project)
+    previous = associations.drop_duplicates("pull_number").set_index("pull_number")["fingerprint"]
+    changed = fingerprints.index[fingerprints.ne(previous.reindex(fingerprints.index))]
+    return concat(
+        [
+            associations[associations["pull_number"].isin(fingerprints.index.difference(changed))],
+            count_associations(dataframe.loc[changed], fingerprints[changed]),
+        ]
+    )
+
+
+def outdated(project):
+    previous = import_associations(project).drop_duplicates("pull_number").set_index("pull_number")["fingerprint"]
+    return not import_fingerprints(project).sort_index().equals(previous.sort_index())
+
+
+def fill_association(dataframe, associations):
+    counts = associations.groupby(["actor", "author_association"])["count"].sum().reset_index().query("count > 0")
+    modes = (
+        counts.assign(value=categorize(counts[["author_association"]].astype("int32"))["author_association"])
+        .astype({"value": "string"})
+        .sort_values(["count", "value"], ascending=[False, True])
+        .drop_duplicates("actor")
+        .set_index("actor")["author_association"]
+    )
+    none = intern("author_association", ["NONE"]).cat.codes.iat[0]
+    dataframe["author_association"] = dataframe["actor"].cat.codes.map(modes).fillna(none).astype("int32")
+    return categorize(dataframe)
 
 
 def fill_core(dataframe):
@@ -49,81 +130,102 @@ def fill_core(dataframe):
     return dataframe.drop(columns="author_association")
 
 
-def fill_abandoned(dataframe):
-    dataframe["abandoned"] = (
-        ~dataframe["merged"] & (dataframe["inactive_days"] >= INACTIVITY) & dataframe[KEYWORDS].any(axis="columns")
-    )
-    return dataframe.drop(columns="inactive_days")
+def fill_abandoned(pulls):
+    pulls["abandoned"] = ~pulls["merged"] & (pulls["inactive_days"] >= INACTIVITY) & match_keywords(pulls["keywords"])
+    return pulls
 
 
-def select_pulls(dataframe, columns=None):
+def select_pulls(pulls, columns=None):
     if columns is not None:
         if not isinstance(columns, list):
             columns = [columns]
-        dataframe = dataframe.query(" and ".join([f"`{column}`" for column in columns]))
-    return dataframe.index.unique("pull_number")
+        pulls = pulls.query(" and ".join([f"`{column}`" for column in columns]))
+    return pulls.index
+
+
+def export_associations(project, associations):
+    store(paths("associations", project), associations, index=False)
 
 
 def export_dataset(project, dataset):
-    dataset.to_csv(paths("dataset", project))
+    store(paths("dataset", project), epochs(identify(dataset)))
+
+
+def export_dataset_pulls(project, pulls):
+    store(paths("dataset_pulls", project), epochs(identify(pulls.drop(columns=["inactive_days", "keywords"]))))
 
 
 def export_sample(project, sample, pulls):
-    pulls.sample(frac=1, random_state=1).query("number in @sample").to_csv(paths("sample", project))
+    store(paths("sample", project), pulls.sample(frac=1, random_state=1).query("number in @sample"))
 
 
-def postprocess_data(project):
+def postprocess_data(project, update=False):
     log = logger(__file__, modules={"sqlitedict": "WARNING"})
     log.info(f"{project}: Postprocessing data")
     dataframe = import_dataframe(project)
+    pulls = import_dataframe_pulls(project)
     metadata = persist(paths("metadata", project))
-    dataframe = fill_association(dataframe)
+    fingerprints = import_fingerprints(project)
+    if update:
+        associations = update_associations(project, dataframe, fingerprints)
+    else:
+        associations = count_associations(dataframe, fingerprints)
+    dataframe = fill_association(dataframe, associations)
     dataframe = fill_core(dataframe)
-    dataframe = fill_abandoned(dataframe)
-    pulled_dataframe = dataframe.query("event == 'pulled'")
-    dataset = dataframe[
-        ~dataframe.index.get_level_values("pull_number").isin(
-            pulled_dataframe[
-                (pulled_dataframe["opened_at"] >= DATE - Timedelta(days=INACTIVITY))
-                | pulled_dataframe["core"]
-                | (pulled_dataframe["actor"] == "ghost")
-            ].index.get_level_values("pull_number")
-        )
+    pulls = fill_association(pulls, associations)
+    pulls = fill_core(pulls)
+    pulls = fill_abandoned(pulls)
+    dataset_pulls = pulls[
+        ~((pulls["opened_at"] >= DATE - Timedelta(days=INACTIVITY)) | pulls["core"] | (pulls["actor"] == "ghost"))
     ]
-    pulled_dataset = dataset.query("event == 'pulled'")
-    sample = select_pulls(pulled_dataset, "abandoned")
+    dataset = dataframe[dataframe.index.get_level_values("pull_number").isin(dataset_pulls.index)]
+    sample = select_pulls(dataset_pulls, "abandoned")
     statistics = {
         "project": project,
         "language": metadata["language"],
         "stars": metadata["watchers"],
-        "months": (pulled_dataframe["time"].max() - pulled_dataframe["time"].min()) // timedelta64(1, "M"),
-        "months-": (pulled_dataset["time"].max() - pulled_dataset["time"].min()) // timedelta64(1, "M"),
-        "cores": pulled_dataframe.query("core")["actor"].nunique(),
-        "cores-": pulled_dataset.query("core")["actor"].nunique(),
-        "contributors": pulled_dataframe.query("not core")["actor"].nunique(),
-        "contributors-": pulled_dataset.query("not core")["actor"].nunique(),
-        "pulls": len(pulled_dataframe),
-        "pulls-": len(pulled_dataset),
-        "open": len(select_pulls(pulled_dataframe, "open")),
-        "open-": len(select_pulls(pulled_dataset, "open")),
-        "closed": len(select_pulls(pulled_dataframe, "closed")),
-        "closed-": len(select_pulls(pulled_dataset, "closed")),
-        "merged": len(select_pulls(pulled_dataframe, "merged")),
-        "merged-": len(select_pulls(pulled_dataset, "merged")),
-        "abandoned": len(select_pulls(pulled_dataframe, "abandoned")),
+        "months": (pulls["opened_at"].max() - pulls["opened_at"].min()) // timedelta64(1, "M"),
+        "months-": (dataset_pulls["opened_at"].max() - dataset_pulls["opened_at"].min()) // timedelta64(1, "M"),
+        "cores": pulls.query("core")["actor"].nunique(),
+        "cores-": dataset_pulls.query("core")["actor"].nunique(),
+        "contributors": pulls.query("not core")["actor"].nunique(),
+        "contributors-": dataset_pulls.query("not core")["actor"].nunique(),
+        "pulls": len(pulls),
+        "pulls-": len(dataset_pulls),
+        "open": len(select_pulls(pulls, "open")),
+        "open-": len(select_pulls(dataset_pulls, "open")),
+        "closed": len(select_pulls(pulls, "closed")),
+        "closed-": len(select_pulls(dataset_pulls, "closed")),
+        "merged": len(select_pulls(pulls, "merged")),
+        "merged-": len(select_pulls(dataset_pulls, "merged")),
+        "abandoned": len(select_pulls(pulls, "abandoned")),
         "abandoned-": len(sample),
     }
+    counts = {"": count_keywords(pulls["keywords"]), "-": count_keywords(dataset_pulls["keywords"])}
     for keyword in KEYWORDS:
-        statistics[keyword] = len(select_pulls(pulled_dataframe, keyword))
-        statistics[f"{keyword}-"] = len(select_pulls(pulled_dataset, keyword))
-    export_dataset(project, dataset.drop(columns=KEYWORDS))
+        for suffix in counts:
+            statistics[f"{keyword}{suffix}"] = counts[suffix][keyword]
+    export_statistics(project, statistics)
+    export_dataset(project, dataset)
+    export_dataset_pulls(project, dataset_pulls)
     export_sample(project, sample, import_pulls(project))
-    return statistics
+    export_associations(project, associations)
+
+
+def export_statistics(project, statistics):
+    (directory := partition("statistics")).mkdir(parents=True, exist_ok=True)
+    store(directory / f"{project.replace('/', '_')}.csv", DataFrame([statistics]), index=False)
 
 
-def export_statistics(statistics):
-    file = paths("statistics")
-    DataFrame(statistics).to_csv(file, header=False if file.exists() else True, index=False, mode="a")
+def merge_statistics():
+    if not (directory := partition("statistics")).exists():
+        return
+    if parts := list(directory.glob("*.csv")):
+        statistics = [read_csv(part) for part in parts]
+        if (file := paths("statistics")).exists():
+            statistics.insert(0, read_csv(file))
+        store(file, concat(statistics).drop_duplicates("project", keep="last"), index=False)
+    rmtree(directory)
 
 
 def main():
@@ -132,12 +234,18 @@ def main():
         print("Skip refreshing statistics")
     projects = []
     for project in processed():
-        if cleanup(["dataset", "sample"], fresh, project):
-            projects.append(project)
+        if incremental() and exist(["dataset", "dataset_pulls", "sample", "associations"], project):
+            if outdated(project):
+                projects.append((project, True))
+            else:
+                print(f"Skip postprocessing up-to-date data for project {project}")
+        elif cleanup(["dataset", "dataset_pulls", "sample", "associations"], fresh, project):
+            projects.append((project, False))
         else:
             print(f"Skip postprocessing data for project {project}")
     with Parallel(n_jobs=-1) as parallel:
-        export_statistics(parallel(delayed(postprocess_data)(project) for project in projects))
+        parallel(delayed(postprocess_data)(project, update) for project, update in projects)
+    merge_statistics()
 
 
 if __name__ == "__main__":
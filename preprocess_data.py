@@ -3,7 +3,7 @@ from csv import QUOTE_ALL
 from joblib import Parallel, delayed
 from pandas import DataFrame
 
-from common import cleanup, collected, initialize, logger, lookup, paths, persist, refresh
+from common import cleanup, collected, epoch, extract, initialize, logger, lookup, paths, persist, refresh
 
 initialize()
 
@@ -120,16 +120,38 @@ def filter_pulls(pulls):
     return rows
 
 
+def aggregate_changes(project):
+    rows = []
+    for pull_number, files in extract(paths("files", project), ["additions", "deletions", "changes"], each=True):
+        rows.append(
+            {
+                "pull_number": int(pull_number),
+                "changed_lines": sum(file["changes"] for file in files),
+                "changed_files": len(files),
+                "additions": sum(file["additions"] for file in files),
+                "deletions": sum(file["deletions"] for file in files),
+            }
+        )
+    return rows
+
+
 def export_timelines(project, timelines):
-    DataFrame(timelines).sort_values(["pull_number", "event_number"]).to_csv(
-        paths("timelines_preprocessed", project), index=False, quoting=QUOTE_ALL
-    )
+    timelines = DataFrame(timelines)
+    timelines.assign(time=epoch(timelines["time"]), merged_at=epoch(timelines["merged_at"])).sort_values(
+        ["pull_number", "event_number"]
+    ).to_csv(paths("timelines_preprocessed", project), index=False, quoting=QUOTE_ALL)
 
 
 def export_pulls(project, pulls):
     DataFrame(pulls).sort_values("number").to_csv(paths("pulls_preprocessed", project), index=False, quoting=QUOTE_ALL)
 
 
+def export_changes(project, changes):
+    DataFrame(changes, columns=["pull_number", "changed_lines", "changed_files", "additions", "deletions"]).sort_values(
+        "pull_number"
+    ).to_csv(paths("changes", project), index=False)
+
+
 def preprocess_data(project):
     log = logger(__file__, modules={"sqlitedict": "WARNING"})
     log.info(f"{project}: Preprocessing data")
@@ -138,12 +160,13 @@ def preprocess_data(project):
     commits = persist(paths("commits", project))
     export_timelines(project, filter_timelines(fix_timelines(project, timelines, pulls, commits)))
     export_pulls(project, filter_pulls(pulls))
+    export_changes(project, aggregate_changes(project))
 
 
 def main():
     projects = []
     for project in collected():
-        if cleanup(["timelines_fixed", "timelines_preprocessed", "pulls_preprocessed"], refresh(), project):
+        if cleanup(["timelines_fixed", "timelines_preprocessed", "pulls_preprocessed", "changes"], refresh(), project):
             projects.append(project)
         else:
             print(f"Skip preprocessing data for project {project}")
@@ -1,10 +1,30 @@
 from csv import QUOTE_ALL
 
-from joblib import Parallel, cpu_count, delayed
-from numpy import arange, array_split
-from pandas import concat, notna, read_csv, to_datetime
-
-from common import DATE, KEYWORDS, cleanup, initialize, logger, paths, preprocessed, refresh
+from joblib import Parallel, delayed
+from pandas import DataFrame, NaT, Series, concat, notna, read_csv
+
+from common import (
+    DATE,
+    KEYWORDS,
+    STRINGS,
+    chunk,
+    cleaned,
+    cleanup,
+    epochs,
+    exist,
+    fingerprint,
+    identify,
+    incremental,
+    initialize,
+    intern,
+    logger,
+    pack_keywords,
+    paths,
+    refresh,
+    resume,
+    store,
+    timestamps,
+)
 
 initialize()
 log = logger(__file__)
@@ -12,10 +32,10 @@ log = logger(__file__)
 
 def import_timelines(project):
     file = paths("timelines_preprocessed", project)
-    return read_csv(
+    timelines = read_csv(
         file,
         index_col=["pull_number", "event_number"],
-        usecols=[column for column in read_csv(file, nrows=0) if column not in ["author.name", "author.email"]],
+        usecols=[column for column in read_csv(file, nrows=0) if column not in ["author.name", "author.email", "body"]],
         dtype={
             "event": "category",
             "actor": "category",
@@ -23,52 +43,74 @@ def import_timelines(project):
             "state": "category",
             "commit_id": "category",
             "referenced": "boolean",
-            "body": "string",
         },
-        parse_dates=["time", "merged_at"],
-        date_parser=lambda time: to_datetime(time, infer_datetime_format=True).tz_convert(tz=None),
         quoting=QUOTE_ALL,
+    ).pipe(timestamps)
+    return timelines.assign(**{column: intern(column, timelines[column]) for column in STRINGS})
+
+
+def import_comments(project):
+    return read_csv(
+        paths("comments", project),
+        index_col=["pull_number", "event_number"],
+        dtype={"body": "string"},
+        keep_default_na=False,
+    ).squeeze("columns")
+
+
+def import_table(file, index):
+    return read_csv(
+        file,
+        index_col=index,
+        dtype={column: "int64" if column in index else "string" for column in read_csv(file, nrows=0)},
+        keep_default_na=False,
     )
 
 
-def chunk_timelines(project):
-    groups = [group[1] for group in import_timelines(project).groupby("pull_number")]
-    for indices in array_split(arange(len(groups)), cpu_count()):
-        yield concat([groups[index] for index in indices])
+def import_dataframe(project):
+    return import_table(paths("dataframe", project), ["pull_number", "event_number"])
+
+
+def import_dataframe_pulls(project):
+    return import_table(paths("dataframe_pulls", project), ["pull_number"])
 
 
-def fill_status(timelines):
+def import_fingerprints(project):
+    return read_csv(paths("fingerprints", project), index_col="pull_number").squeeze("columns")
+
+
+def find_pulls(timelines):
+    pulled = timelines.query("event == 'pulled'").droplevel("event_number")
+    return DataFrame({"actor": pulled["actor"], "opened_at": pulled["time"]})
+
+
+def fill_status(pulls, timelines):
     def find_status(timeline):
         pulled = timeline.query("event == 'pulled'")
         closed = timeline.query("event == 'closed'")
-        timeline["opened_at"] = pulled["time"].iat[0]
-        timeline = timeline.assign(closed_at=None, merged_at=None, open=False, closed=False, merged=False)
+        status = {"closed_at": NaT, "merged_at": NaT, "open": False, "closed": False, "merged": False}
         if pulled["state"].iat[0] == "closed":
-            if notna(merged_time := pulled["merged_time"].iat[0]):
-                timeline["merged"] = True
-                timeline["merged_at"] = merged_time
+            if notna(merged_at := pulled["merged_at"].iat[0]):
+                status.update(merged=True, merged_at=merged_at)
             elif not closed.empty and notna(closed["commit_id"].iat[-1]):
-                timeline["merged"] = True
-                timeline["merged_at"] = closed["time"].iat[-1]
+                status.update(merged=True, merged_at=closed["time"].iat[-1])
             elif not (referenced := timeline.query("referenced")).empty:
-                timeline["merged"] = True
-                timeline["merged_at"] = referenced["time"].iat[0]
+                status.update(merged=True, merged_at=referenced["time"].iat[0])
             else:
-                timeline["closed"] = True
+                status["closed"] = True
                 if not closed.empty:
-                    timeline["closed_at"] = closed["time"].iat[-1]
+                    status["closed_at"] = closed["time"].iat[-1]
         else:
-            timeline["open"] = True
-        return timeline[["opened_at", "closed_at", "merged_at", "open", "closed", "merged"]]
+            status["open"] = True
+        return Series(status)
 
-    timelines = timelines.rename(columns={"merged_at": "merged_time"})
-    timelines[["opened_at", "closed_at", "merged_at", "open", "closed", "merged"]] = (
-        timelines[["event", "time", "merged_time", "state", "commit_id", "referenced"]]
-        .groupby("pull_number", group_keys=False)
+    pulls[["closed_at", "merged_at", "open", "closed", "merged"]] = (
+        timelines[["event", "time", "merged_at", "state", "commit_id", "referenced"]]
+        .groupby("pull_number")
         .apply(find_status)
     )
-    return timelines.drop(columns=["merged_time", "state", "commit_id", "referenced"]).astype(
-        {"closed_at": "datetime64[ns]", "merged_at": "datetime64[ns]"}
+    return pulls.astype(
+        {"closed_at": "datetime64[ns]", "merged_at": "datetime64[ns]", "open": bool, "closed": bool, "merged": bool}
     )
 
 
@@ -94,65 +136,88 @@ def fill_last_activity(timelines):
     return timelines.fillna({"last_activity": False})
 
 
-def fill_inactive_days(timelines):
-    def find_inactive_days(timeline):
-        timeline["inactive_days"] = (DATE - timeline.query("last_activity")["time"].iat[-1]).days
-        return timeline[["inactive_days"]]
-
-    timelines["inactive_days"] = (
-        timelines[["time", "last_activity"]].groupby("pull_number", group_keys=False).apply(find_inactive_days)
-    )
-    return timelines.astype({"inactive_days": "uint16"})
+def fill_inactive_days(pulls, timelines):
+    pulls["inactive_days"] = (DATE - timelines.query("last_activity").groupby("pull_number")["time"].max()).dt.days
+    return pulls.astype({"inactive_days": "uint16"})
 
 
-def fill_keywords(timelines):
-    def find_keywords(timeline):
-        if (comments := timeline.query("not contributor and event == 'commented'")["body"]).empty:
-            timeline = timeline.assign(**dict.fromkeys(KEYWORDS, False))
-        else:
-            for keyword in KEYWORDS:
-                timeline[keyword] = comments.str.contains(keyword, regex=False).any()
-        return timeline[KEYWORDS]
-
-    timelines["body"] = (
-        timelines["body"]
-        .str.replace(r"(?s)(?:(?<!\\)((?:\\{2})+)(?=`+)|(?<!\\)(`+)(.+?)(?<!`)\2(?!`))", "", regex=True)
-        .str.replace(r"(?m)^>.*?$", "", regex=True)
-        .str.lower()
-    )
-    timelines[KEYWORDS] = (
-        timelines[["event", "body", "contributor"]].groupby("pull_number", group_keys=False).apply(find_keywords)
-    )
-    return timelines.drop(columns="body")
+def fill_keywords(pulls, timelines):
+    comments = timelines.query("not contributor and event == 'commented'")["body"]
+    flags = DataFrame({keyword: comments.str.contains(keyword, regex=False) for keyword in KEYWORDS})
+    pulls["keywords"] = pack_keywords(flags.fillna(False).groupby("pull_number").any())
+    return pulls.fillna({"keywords": 0}).astype({"keywords": "uint32"})
 
 
 def process_chunk(chunk):
-    chunk = fill_status(chunk)
     chunk = fill_contributor(chunk)
     chunk = fill_last_activity(chunk)
-    chunk = fill_inactive_days(chunk)
-    return fill_keywords(chunk)
+    pulls = find_pulls(chunk)
+    pulls = fill_status(pulls, chunk)
+    pulls = fill_inactive_days(pulls, chunk)
+    pulls = fill_keywords(pulls, chunk)
+    return (
+        epochs(identify(chunk.drop(columns=["merged_at", "state", "commit_id", "referenced", "body"]))),
+        epochs(identify(pulls)),
+    )
 
 
-def export_dataframe(project, dataframe):
-    dataframe.to_csv(paths("dataframe", project))
+def export_fingerprints(project, fingerprints):
+    store(paths("fingerprints", project), fingerprints)
 
 
 def process_data(project):
     log.info(f"{project}: Processing data")
+    timelines = import_timelines(project).join(import_comments(project))
+    with Parallel(n_jobs=-1) as parallel:
+        resume(
+            ["dataframe", "dataframe_pulls"],
+            project,
+            process_chunk,
+            chunk(timelines.index.unique("pull_number")),
+            load=lambda pull_numbers: timelines.loc[pull_numbers],
+            parallel=parallel,
+        )
+    export_fingerprints(project, fingerprint(timelines))
+
+
+def update_data(project):
+    timelines = import_timelines(project).join(import_comments(project))
+    fingerprints = fingerprint(timelines)
+    previous = import_fingerprints(project)
+    changed = fingerprints.index[fingerprints.ne(previous.reindex(fingerprints.index))]
+    removed = previous.index.difference(fingerprints.index)
+    if changed.empty and removed.empty:
+        log.info(f"{project}: Processed data is up to date")
+        return
+    log.info(f"{project}: Updating data for {len(changed)} changed and {len(removed)} removed pull requests")
     with Parallel(n_jobs=-1) as parallel:
-        export_dataframe(project, concat(parallel(delayed(process_chunk)(chunk) for chunk in chunk_timelines(project))))
+        chunks = parallel(delayed(process_chunk)(timelines.loc[pull_numbers]) for pull_numbers in chunk(changed))
+    stale = previous.index.intersection(changed.union(removed))
+    dataframe = import_dataframe(project)
+    pulls = import_dataframe_pulls(project)
+    if len(pulls.index.intersection(stale)) != len(stale):
+        raise RuntimeError(f"{project}: Processed data is out of sync with its fingerprints")
+    dataframe = dataframe.drop(index=stale, level="pull_number")
+    pulls = pulls.drop(index=stale)
+    store(paths("dataframe", project), concat([dataframe, *[events for events, _ in chunks]]).sort_index())
+    store(paths("dataframe_pulls", project), concat([pulls, *[table for _, table in chunks]]).sort_index())
+    export_fingerprints(project, fingerprints)
 
 
 def main():
     projects = []
-    for project in preprocessed():
-        if cleanup("dataframe", refresh(), project):
+    updates = []
+    for project in cleaned():
+        if incremental() and exist(["dataframe", "dataframe_pulls", "fingerprints"], project):
+            updates.append(project)
+        elif cleanup(["dataframe", "dataframe_pulls", "fingerprints"], refresh(), project):
             projects.append(project)
         else:
             print(f"Skip processing data for project {project}")
     for project in projects:
         process_data(project)
+    for project in updates:
+        update_data(project)
 
 
 if __name__ == "__main__":
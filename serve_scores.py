@@ -0,0 +1,152 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from threading import Lock
+
+from joblib import load
+from numpy import array, float32, timedelta64
+from pandas import Timestamp
+
+from common import initialize, logger, measured, paths, persist, strings
+from state import import_state, index_state, snapshot
+
+initialize()
+log = logger(__file__, modules={"sqlitedict": "WARNING"})
+HOST = "127.0.0.1"
+PORT = 8050
+RESPONSES = ["commented", "reviewed", "line-commented", "commit-commented"]
+cache = {}
+lock = Lock()
+
+
+def load_state(project):
+    metadata = persist(paths("metadata", project))
+    return {
+        "created_at": Timestamp(metadata["created_at"]).tz_convert(tz=None),
+        "index": index_state(import_state(project)),
+        "actors": {actor: number for number, actor in enumerate(strings("actor"))},
+    }
+
+
+def load_project(project):
+    files = {"model": paths("model", project), "state": paths("state", project)}
+    with lock:
+        entry = cache.get(project, {})
+        for name, loader in [("model", lambda: load(files["model"])), ("state", lambda: load_state(project))]:
+            if entry.get(f"{name}_time") != (modified := files[name].stat().st_mtime_ns):
+                log.info(f"{project}: Loading {name}")
+                entry.update({name: loader(), f"{name}_time": modified})
+        cache[project] = entry
+    return entry
+
+
+def timestamp(time):
+    time = Timestamp(time)
+    return time.tz_convert(tz=None) if time.tzinfo is not None else time
+
+
+def measure_pull(state, pull):
+    opened_at = timestamp(pull["opened_at"])
+    lifetime = timestamp(pull.get("time", Timestamp.now(tz="UTC"))) - opened_at
+    history = snapshot(state["index"], state["actors"].get(pull["actor"]), opened_at)
+    responses = [
+        (response["actor"], timestamp(response["time"]))
+        for response in pull.get("responses", [])
+        if response.get("event", "commented") in RESPONSES and timestamp(response["time"]) > opened_at
+    ]
+    participant_times = sorted(time for actor, time in responses if actor != pull["actor"])
+    return {
+        "pr_description": len((pull.get("title", "") + " " + (pull.get("body") or "")).split()),
+        "pr_commits": pull.get("commits", 0),
+        "pr_changed_lines": pull.get("changed_lines", 0),
+        "pr_changed_files": pull.get("changed_files", 0),
+        "pr_lifetime": lifetime // timedelta64(1, "D"),
+        "contributor_pulls": history["contributor_pulls"],
+        "contributor_contribution_period": history["contributor_contribution_period"],
+        "contributor_acceptance_rate": history["contributor_acceptance_rate"],
+        "contributor_abandonment_rate": history["contributor_abandonment_rate"],
+        "review_participants": len({actor for actor, time in responses if actor != pull["actor"]}),
+        "review_participant_responses": len(participant_times),
+        "review_contributor_responses": len(responses) - len(participant_times),
+        "review_response_latency": (
+            (participant_times[0] - opened_at if participant_times else lifetime) // timedelta64(1, "D")
+        ),
+        "review_responses_interval": (
+            ((participant_times[-1] - opened_at) / len(participant_times) if participant_times else lifetime)
+            // timedelta64(1, "D")
+        ),
+        "project_age": (opened_at - state["created_at"]) // timedelta64(1, "M"),
+        "project_pulls": history["project_pulls"],
+        "project_contributors": history["project_contributors"],
+        "project_unresolved_pulls": history["project_unresolved_pulls"],
+    }
+
+
+def score_pulls(pulls):
+    scores = [None] * len(pulls)
+    projects = {}
+    for index, pull in enumerate(pulls):
+        projects.setdefault(pull["project"], []).append(index)
+    for project, indices in projects.items():
+        entry = load_project(project)
+        columns = entry["model"]["columns"]
+        model = entry["model"]["model"]
+        features = array(
+            [[measure_pull(entry["state"], pulls[index])[column] for column in columns] for index in indices],
+            dtype=float32,
+        )
+        probabilities = model.predict_proba(features)[:, 1]
+        for index, probability in zip(indices, probabilities):
+            scores[index] = {"project": project, "probability": float(probability)}
+    return scores
+
+
+class ScoreHandler(BaseHTTPRequestHandler):
+    def respond(self, status, data):
+        body = dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.respond(200, {"projects": sorted(cache)})
+        else:
+            self.respond(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/score":
+            self.respond(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            data = loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            scores = score_pulls(data if isinstance(data, list) else [data])
+        except (KeyError, TypeError, ValueError, FileNotFoundError) as exception:
+            self.respond(400, {"error": f"{type(exception).__name__}: {exception}"})
+        else:
+            self.respond(200, scores if isinstance(data, list) else scores[0])
+
+    def log_message(self, format, *arguments):
+        log.debug(format % arguments)
+
+
+def serve_scores():
+    for project in measured():
+        if paths("model", project).exists():
+            load_project(project)
+    log.info(f"Serving scores for {len(cache)} projects on http://{HOST}:{PORT}")
+    with ThreadingHTTPServer((HOST, PORT), ScoreHandler) as server:
+        server.serve_forever()
+
+
+def main():
+    serve_scores()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Stop serving scores")
+        exit(1)
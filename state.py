@@ -0,0 +1,112 @@
+from numpy import concatenate, cumsum, isnat, searchsorted, sort, timedelta64
+from pandas import Timestamp, concat, read_csv
+
+from common import epochs, paths, store, timestamps
+
+STATUS = ["merged_at", "closed_at", "open", "abandoned"]
+
+
+def import_state(project):
+    return read_csv(
+        paths("state", project),
+        dtype={"actor": "int32"},
+    ).pipe(timestamps)
+
+
+def count_state(pulled, state=None):
+    if state is None:
+        state = pulled.iloc[:0].assign(contributor_pulls=0, contributor_first=None, project_contributors=0)
+    previous = state.groupby("actor")
+    pulled = pulled.assign(
+        contributor_pulls=previous.size().reindex(pulled["actor"], fill_value=0).values
+        + pulled.groupby("actor").cumcount(),
+        contributor_first=previous["opened_at"].min().reindex(pulled["actor"]).values,
+    )
+    pulled["contributor_first"] = pulled["contributor_first"].fillna(
+        pulled.groupby("actor")["opened_at"].transform("min")
+    )
+    first = ~pulled["actor"].isin(state["actor"]) & ~pulled["actor"].duplicated()
+    pulled["project_contributors"] = state["actor"].nunique() + first.cumsum().shift(fill_value=0)
+    return pulled
+
+
+def export_state(project, state, append=False):
+    if append:
+        epochs(state).to_csv(paths("state", project), header=False, index=False, mode="a")
+    else:
+        store(paths("state", project), epochs(state), index=False)
+
+
+def select_state(pulled):
+    return (
+        pulled.reset_index()[["pull_number", "actor", "opened_at", *STATUS]]
+        .astype({"actor": "int32"})
+        .sort_values("pull_number", ignore_index=True)
+    )
+
+
+def update_state(project, pulled):
+    pulled = select_state(pulled)
+    if not paths("state", project).exists():
+        export_state(project, state := count_state(pulled))
+        return state
+    state = import_state(project)
+    new = pulled[~pulled["pull_number"].isin(state["pull_number"])]
+    if not state["pull_number"].isin(pulled["pull_number"]).all() or (
+        not new.empty and new["pull_number"].min() < state["pull_number"].max()
+    ):
+        export_state(project, state := count_state(pulled))
+        return state
+    state = state.set_index("pull_number")
+    current = pulled.set_index("pull_number").loc[state.index, STATUS]
+    appended = count_state(new, state.reset_index())
+    if current.astype("string").equals(state[STATUS].astype("string")):
+        export_state(project, appended, append=True)
+        return concat([state.reset_index(), appended], ignore_index=True)
+    state[STATUS] = current
+    export_state(project, state := concat([state.reset_index(), appended], ignore_index=True))
+    return state
+
+
+def index_state(state):
+    opened = state["opened_at"].values
+    merged = state["merged_at"].values
+    abandoned = state["abandoned"].values.astype("int64")
+    actors = {}
+    for actor, positions in state.groupby("actor").indices.items():
+        actors[actor] = {
+            "positions": positions,
+            "merged": sort(merged[positions][~isnat(merged[positions])]),
+            "abandoned": concatenate([[0], cumsum(abandoned[positions])]),
+            "first": Timestamp(opened[positions[0]]),
+        }
+    resolved = state.loc[~state["open"], ["merged_at", "closed_at", "opened_at"]]
+    return {
+        "pulls": dict(zip(state["pull_number"], range(len(state)))),
+        "opened": opened,
+        "resolved": sort(resolved["merged_at"].fillna(resolved["closed_at"]).fillna(resolved["opened_at"]).values),
+        "contributors": state["project_contributors"].values,
+        "actors": actors,
+    }
+
+
+def snapshot(index, actor, time, position=None):
+    time = Timestamp(time)
+    if position is None:
+        position = searchsorted(index["opened"], time.to_datetime64())
+    pulls = 0
+    if (contributor := index["actors"].get(actor)) is not None:
+        pulls = searchsorted(contributor["positions"], position)
+    return {
+        "contributor_pulls": pulls,
+        "contributor_contribution_period": (time - contributor["first"]) // timedelta64(1, "M") if pulls else 0,
+        "contributor_acceptance_rate": (
+            searchsorted(contributor["merged"], time.to_datetime64()) / pulls if pulls else 0
+        ),
+        "contributor_abandonment_rate": contributor["abandoned"][pulls] / pulls if pulls else 0,
+        "project_pulls": position,
+        "project_contributors": (
+            index["contributors"][position] if position < len(index["contributors"]) else len(index["actors"])
+        ),
+        "project_unresolved_pulls": position - searchsorted(index["resolved"], time.to_datetime64()),
+    }
@@ -0,0 +1,120 @@
+from joblib import Parallel, delayed
+from numpy import array, repeat, searchsorted, sort, tile, timedelta64
+from pandas import DataFrame, NaT, Series, Timedelta, concat
+
+from common import (
+    DATE,
+    KEYWORDS,
+    cleanup,
+    count_keywords,
+    initialize,
+    logger,
+    mask_keywords,
+    paths,
+    persist,
+    postprocessed,
+    refresh,
+    store,
+    unpack_keywords,
+)
+from postprocess_data import fill_association, fill_core, import_associations, import_dataframe_pulls
+
+initialize()
+log = logger(__file__, modules={"sqlitedict": "WARNING"})
+THRESHOLDS = [30, 61, 91, 122, 152, 183, 213, 244, 274, 305, 335, 365]
+
+
+def select_keywords():
+    return [
+        KEYWORDS,
+        *[[keyword] for keyword in KEYWORDS],
+        *[[other for other in KEYWORDS if other != keyword] for keyword in KEYWORDS],
+    ]
+
+
+def import_pulls(project):
+    return fill_core(fill_association(import_dataframe_pulls(project), import_associations(project)))
+
+
+def count_actors(pulls, selected, cutoffs):
+    first = pulls.loc[selected].groupby("actor", observed=True)["opened_at"].min().to_numpy()
+    return (first[:, None] < cutoffs).sum(axis=0)
+
+
+def measure_months(opened, selected, cutoffs):
+    dates = sort(opened[selected])
+    spans = [dates[position - 1] - dates[0] if position else NaT for position in searchsorted(dates, cutoffs)]
+    return (Series(spans, dtype="timedelta64[ns]") // timedelta64(1, "M")).to_numpy()
+
+
+def sweep_project(project):
+    log.info(f"{project}: Sweeping sensitivity")
+    pulls = import_pulls(project)
+    metadata = persist(paths("metadata", project))
+    subsets = select_keywords()
+    thresholds = array(THRESHOLDS)
+    cutoffs = array([DATE - Timedelta(days=threshold) for threshold in THRESHOLDS], dtype="datetime64[ns]")
+    opened = pulls["opened_at"].to_numpy()
+    selected = (~pulls["core"] & (pulls["actor"] != "ghost")).to_numpy()
+    included = selected[:, None] & (opened[:, None] < cutoffs)
+    inactive = ~pulls["merged"].to_numpy()[:, None] & (pulls["inactive_days"].to_numpy()[:, None] >= thresholds)
+    hits = (pulls["keywords"].to_numpy()[:, None] & array([mask_keywords(subset) for subset in subsets])) != 0
+    abandoned = inactive.T.astype("int64") @ hits
+    abandoned_included = (inactive & included).T.astype("int64") @ hits
+    statuses = included.T.astype("int64") @ pulls[["open", "closed", "merged"]].to_numpy("int64")
+    counts = count_keywords(pulls["keywords"])
+    counts_included = included.T.astype("int64") @ unpack_keywords(pulls["keywords"]).to_numpy("int64")
+    width = len(subsets)
+    sensitivity = {
+        "project": project,
+        "threshold": repeat(thresholds, width),
+        "subset": tile(["|".join(subset) for subset in subsets], len(THRESHOLDS)),
+        "language": metadata["language"],
+        "stars": metadata["watchers"],
+        "months": (pulls["opened_at"].max() - pulls["opened_at"].min()) // timedelta64(1, "M"),
+        "months-": repeat(measure_months(opened, selected, cutoffs), width),
+        "cores": pulls.query("core")["actor"].nunique(),
+        "cores-": repeat(count_actors(pulls, selected & pulls["core"].to_numpy(), cutoffs), width),
+        "contributors": pulls.query("not core")["actor"].nunique(),
+        "contributors-": repeat(count_actors(pulls, selected & ~pulls["core"].to_numpy(), cutoffs), width),
+        "pulls": len(pulls),
+        "pulls-": repeat(included.sum(axis=0), width),
+        "open": pulls["open"].sum(),
+        "open-": repeat(statuses[:, 0], width),
+        "closed": pulls["closed"].sum(),
+        "closed-": repeat(statuses[:, 1], width),
+        "merged": pulls["merged"].sum(),
+        "merged-": repeat(statuses[:, 2], width),
+        "abandoned": abandoned.ravel(),
+        "abandoned-": abandoned_included.ravel(),
+    }
+    for position, keyword in enumerate(KEYWORDS):
+        sensitivity[keyword] = counts[keyword]
+        sensitivity[f"{keyword}-"] = repeat(counts_included[:, position], width)
+    return DataFrame(sensitivity)
+
+
+def export_sensitivity(sensitivity):
+    store(paths("sensitivity"), sensitivity, index=False)
+
+
+def sweep_sensitivity():
+    log.info("Sweeping sensitivity")
+    with Parallel(n_jobs=-1) as parallel:
+        sweeps = parallel(delayed(sweep_project)(project) for project in postprocessed())
+    export_sensitivity(concat(sweeps, ignore_index=True))
+
+
+def main():
+    if cleanup("sensitivity", refresh()):
+        sweep_sensitivity()
+    else:
+        print("Skip sweeping sensitivity")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Stop sweeping sensitivity")
+        exit(1)
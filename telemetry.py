@@ -0,0 +1,126 @@
+from collections import deque
+from datetime import datetime, timezone
+from json import dumps
+from os import getpid, replace
+from socket import gethostname
+from threading import Event, Lock, Thread
+from time import time
+
+from common import estimates, paths
+
+FLUSH = 30
+WINDOW = 300
+SAMPLES = 1000
+lock = Lock()
+started = time()
+counts = {"rotations": 0, "retry_errors": 0, "unprocessable": 0, "excluded": 0, "errors": 0}
+quotas = {}
+consumed = deque()
+projects = {}
+writes = deque(maxlen=SAMPLES)
+
+
+def mask_token(token):
+    return f"...{token[-4:]}"
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds")
+
+
+def observe_quota(token, client):
+    remaining, limit = client.rate_limiting
+    reset = client.rate_limiting_resettime
+    with lock:
+        if (previous := quotas.get(token)) is not None:
+            used = previous["remaining"] - remaining if previous["reset"] == reset else limit - remaining
+            consumed.append((time(), max(used, 0)))
+        quotas[token] = {"remaining": remaining, "limit": limit, "reset": reset}
+
+
+def count(kind):
+    with lock:
+        counts[kind] += 1
+
+
+def track_project(project, collected):
+    with lock:
+        if not projects:
+            projects.update({name: {"expected": pulls} for name, pulls in estimates().items()})
+        progress = projects.setdefault(project, {"expected": None})
+        progress.setdefault("recent", deque())
+        progress["collected"] = collected
+
+
+def record_pull(project):
+    with lock:
+        projects[project]["collected"] += 1
+        projects[project]["recent"].append(time())
+
+
+def record_write(seconds):
+    with lock:
+        writes.append(seconds)
+
+
+def report():
+    now = time()
+    with lock:
+        while consumed and consumed[0][0] < now - WINDOW:
+            consumed.popleft()
+        window = min(WINDOW, now - started)
+        latencies = sorted(writes)
+        telemetry = {
+            "time": format_time(now),
+            "uptime": round(now - started),
+            "requests_per_second": round(sum(used for _, used in consumed) / window, 2) if window else 0.0,
+            "counts": dict(counts),
+            "tokens": {
+                mask_token(token): {**quota, "reset": format_time(quota["reset"])} for token, quota in quotas.items()
+            },
+            "writes": {
+                "samples": len(latencies),
+                "mean": round(sum(latencies) / len(latencies), 4) if latencies else None,
+                "p95": round(latencies[int(0.95 * (len(latencies) - 1))], 4) if latencies else None,
+                "max": round(latencies[-1], 4) if latencies else None,
+            },
+            "projects": {},
+        }
+        for project, progress in projects.items():
+            if "collected" not in progress:
+                continue
+            while progress["recent"] and progress["recent"][0] < now - WINDOW:
+                progress["recent"].popleft()
+            rate = len(progress["recent"]) / window if window else 0.0
+            left = max(progress["expected"] - progress["collected"], 0) if progress["expected"] is not None else None
+            telemetry["projects"][project] = {
+                "collected": progress["collected"],
+                "expected": progress["expected"],
+                "pulls_per_minute": round(rate * 60, 2),
+                "eta": format_time(now + left / rate) if left is not None and rate else None,
+            }
+    return telemetry
+
+
+def export_telemetry():
+    (directory := paths("telemetry")).mkdir(parents=True, exist_ok=True)
+    file = directory / f"{gethostname()}_{getpid()}.json"
+    temporary = file.with_name(f"{file.name}.tmp")
+    temporary.write_text(dumps(report(), indent=2))
+    replace(temporary, file)
+
+
+def flush_telemetry(stop):
+    while not stop.wait(FLUSH):
+        export_telemetry()
+
+
+def start_telemetry():
+    stop = Event()
+    Thread(target=flush_telemetry, args=(stop,), daemon=True).start()
+    return stop
+
+
+def stop_telemetry(stop):
+    stop.set()
+    export_telemetry()